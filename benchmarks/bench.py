@@ -0,0 +1,256 @@
+# Times each stage of a rename on generated trees of empty media files:
+# scanning, adding to a list, building the destinations, planning, opening
+# the preview and renaming. Results are written as JSON so runs from
+# different versions can be compared with --compare.
+#
+# Example:
+#   python benchmarks/bench.py --sizes 10000 100000 --output new.json
+#   python benchmarks/bench.py --sizes 10000 100000 --compare old.json
+#
+# GUI stages use Qt's offscreen platform unless QT_QPA_PLATFORM is set.
+# --startup also times how long rename.py takes to show its window, starting
+# a fresh process each time.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dirScanner
+import renameCore
+import renamePlanner
+
+DEFAULT_SIZES = [10000, 100000]
+LAYOUTS = ("flat", "deep")
+STAGES = ("scan", "list", "dests", "plan", "preview", "rename")
+# flat: lots of files in a few directories
+FLAT_FILES_PER_DIR = 5000
+# deep: a few files at the bottom of a tree of nested directories
+DEEP_FILES_PER_DIR = 10
+DEEP_LEVELS = 6
+DEEP_FANOUT = 8
+# Cold starts to time with --startup; the median is reported
+STARTUP_RUNS = 5
+
+
+def filePath(top, layout, i):
+    if layout == "flat":
+        dirs = [f"season {i // FLAT_FILES_PER_DIR:03d}"]
+    else:
+        leaf = i // DEEP_FILES_PER_DIR
+        dirs = []
+        for _ in range(DEEP_LEVELS):
+            dirs.append(f"d{leaf % DEEP_FANOUT}")
+            leaf //= DEEP_FANOUT
+    return os.path.join(top, *dirs, f"Some Show - S01E{i:07d} [1080p].mkv")
+
+
+def makeTree(top, layout, n):
+    """Create n empty files under top and return their paths."""
+    paths = [filePath(top, layout, i) for i in range(n)]
+    for d in {os.path.dirname(p) for p in paths}:
+        os.makedirs(d, exist_ok=True)
+    for p in paths:
+        open(p, "wb").close()
+    return paths
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def qtApp():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6 import QtWidgets
+
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def benchTree(top, layout, n, stages):
+    """Run the stages on a fresh tree and return {stage: seconds}."""
+    makeTree(top, layout, n)
+    results = {}
+
+    def scan():
+        return [p for batch, dirs in dirScanner.scanTree(top) for p in batch]
+
+    t, sources = timed(scan)
+    if "scan" in stages:
+        results["scan"] = t
+
+    if "list" in stages:
+        app = qtApp()
+        from customList import CustomList
+
+        lst = CustomList()
+        lst.show()
+
+        def fill():
+            lst.addFilenames(sources)
+            app.processEvents()
+
+        results["list"], _ = timed(fill)
+        lst.close()
+        lst.deleteLater()
+
+    basenames = [f"Template Show - {i:07d}" for i in range(len(sources))]
+    t, dests = timed(lambda: renameCore.getDests(basenames, sources, [".new"]))
+    if "dests" in stages:
+        results["dests"] = t
+
+    t, plan = timed(lambda: renamePlanner.planRenames(sources, dests))
+    if "plan" in stages:
+        results["plan"] = t
+
+    if "preview" in stages:
+        app = qtApp()
+        from previewWindow import PreviewDialog
+
+        def preview():
+            dialog = PreviewDialog(sources, dests)
+            dialog.show()
+            app.processEvents()
+            return dialog
+
+        results["preview"], dialog = timed(preview)
+        dialog.close()
+        dialog.deleteLater()
+
+    if "rename" in stages:
+        results["rename"], failures = timed(
+            lambda: renameCore.renameFiles(plan.sources, plan.dests)
+        )
+        if failures:
+            raise RuntimeError(f"{len(failures)} renames failed")
+    return results
+
+
+def startupTime():
+    """Seconds from starting rename.py to its window being shown."""
+    env = dict(os.environ, RENAME_STARTUP_CHECK="1")
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    start = time.time()
+    out = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "rename.py")],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(out.stdout.split()[-1]) - start
+
+
+def gitVersion():
+    try:
+        out = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def runAll(sizes, layouts, stages, workDir=None, startup=False):
+    report = {
+        "version": gitVersion(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [],
+    }
+    if startup:
+        times = sorted(startupTime() for _ in range(STARTUP_RUNS))
+        t = times[len(times) // 2]
+        report["results"].append(
+            {"stage": "startup", "layout": None, "files": 0, "seconds": round(t, 6)}
+        )
+        print(f"{'':>5} {0:>8} {'startup':>8} {t:10.4f}s", file=sys.stderr)
+    for layout in layouts:
+        for n in sizes:
+            top = tempfile.mkdtemp(prefix="rename-bench-", dir=workDir)
+            try:
+                times = benchTree(top, layout, n, stages)
+            finally:
+                shutil.rmtree(top, ignore_errors=True)
+            for stage in STAGES:
+                if stage in times:
+                    report["results"].append(
+                        {
+                            "stage": stage,
+                            "layout": layout,
+                            "files": n,
+                            "seconds": round(times[stage], 6),
+                        }
+                    )
+                    print(
+                        f"{layout:>5} {n:>8} {stage:>8} {times[stage]:10.4f}s",
+                        file=sys.stderr,
+                    )
+    return report
+
+
+def compare(old, new):
+    """Print how long each stage took in new relative to old."""
+    key = lambda r: (r["stage"], r["layout"], r["files"])
+    before = {key(r): r["seconds"] for r in old["results"]}
+    print(f"{old.get('version')} -> {new.get('version')}")
+    for r in new["results"]:
+        prev = before.get(key(r))
+        if prev:
+            change = (r["seconds"] - prev) / prev * 100
+            print(
+                f"{r['layout'] or '':>5} {r['files']:>8} {r['stage']:>8} "
+                f"{prev:10.4f}s {r['seconds']:10.4f}s {change:+7.1f}%"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the rename stages.")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=DEFAULT_SIZES,
+        help="numbers of files to generate (default: %(default)s)",
+    )
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=list(LAYOUTS))
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument(
+        "--dir", help="where to create the test trees (default: system temp dir)"
+    )
+    parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="also time how long the main window takes to come up",
+    )
+    parser.add_argument("-o", "--output", help="write the results here as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    args = parser.parse_args(argv)
+
+    report = runAll(args.sizes, args.layouts, args.stages, args.dir, args.startup)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    elif not args.compare:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
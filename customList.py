@@ -1,38 +1,384 @@
 # Tynan McGee
 # 6/5/2022
-# QListWidget with ability for files to be drag/dropped in and with items being
+# QListView with ability for files to be drag/dropped in and with items being
 # deselected when you click in a blank area. Includes functions which can be
 # attached to buttons allowing for moving, removing, and clearing selected
 # items, as well as for adding items using file and directory browsing.
+# The files are kept in a PathStore behind a list model rather than as one
+# QListWidgetItem each, so very long lists stay cheap.
 
-# https://doc.qt.io/qtforpython/PySide6/QtWidgets/QListWidget.html
+# https://doc.qt.io/qtforpython/PySide6/QtWidgets/QListView.html
+# https://doc.qt.io/qtforpython/PySide6/QtCore/QAbstractListModel.html
 
 import os
 from PySide6 import QtCore, QtWidgets, QtGui
+from pathStore import PathStore
+from dirScanner import scanTree
+import scanCache
+from dirWatcher import DirWatcher
+import tracing
+from naturalSort import SortKeys, SortOptions
 
+# Mime type used when dragging rows around inside a list. The rows being moved
+# are taken from the view's selection, so it doesn't carry any data.
+ROWS_MIME_TYPE = "application/x-filename-rename-rows"
+# Removing more separate blocks of rows than this resets the model in one go
+# instead of removing each block on its own
+MAX_REMOVE_RANGES = 50
+# Number of rows the view lays out at a time
+LAYOUT_BATCH_SIZE = 1000
 
-class CustomList(QtWidgets.QListWidget):
+
+def mergeRanges(ranges):
+    """Sort (first, last) row ranges and merge the ones that overlap or touch,
+    so that every range is separated from the next by at least one row."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+class FileListModel(QtCore.QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.store = PathStore()
+        self.sortOptions = SortOptions()
+        self.sortKeys = SortKeys()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.store)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self.store.displayName(index.row())
+        if role == QtCore.Qt.ToolTipRole:
+            # Show the full path of the item in its tooltip
+            return self.store.path(index.row())
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            # Allow dropping between items
+            return QtCore.Qt.ItemIsDropEnabled
+        return (
+            QtCore.Qt.ItemIsSelectable
+            | QtCore.Qt.ItemIsEnabled
+            | QtCore.Qt.ItemIsDragEnabled
+        )
+
+    def supportedDropActions(self):
+        return QtCore.Qt.MoveAction | QtCore.Qt.CopyAction
+
+    def mimeTypes(self):
+        return [ROWS_MIME_TYPE, "text/uri-list"]
+
+    def mimeData(self, indexes):
+        data = QtCore.QMimeData()
+        data.setData(ROWS_MIME_TYPE, QtCore.QByteArray())
+        return data
+
+    def path(self, row):
+        return self.store.path(row)
+
+    def paths(self):
+        return self.store.paths()
+
+    def addPaths(self, paths, isDirs=None):
+        """Add the paths that aren't in the list yet as one block of rows.
+        isDirs is a dict of path -> whether it's a directory for paths whose
+        type is already known; the rest are checked on disk. Returns the
+        number of rows added."""
+        paths = self.store.newPaths(paths)
+        if not paths:
+            return 0
+        if isDirs is None:
+            isDirs = {}
+        with tracing.span("add to list", files=len(paths)):
+            types = [isDirs[p] if p in isDirs else os.path.isdir(p) for p in paths]
+            if tracing.enabled:
+                tracing.count("stat calls", sum(p not in isDirs for p in paths))
+            n = len(self.store)
+            self.beginInsertRows(QtCore.QModelIndex(), n, n + len(paths) - 1)
+            self.store.extend(paths, types)
+            self.endInsertRows()
+        return len(paths)
+
+    def replacePaths(self, newPaths):
+        """Swap paths for new ones (e.g. after renaming) using a dict of
+        old path -> new path, keeping the order and file types."""
+        paths = [newPaths.get(p, p) for p in self.store.paths()]
+        types = self.store.isDirs()
+        self.beginResetModel()
+        self.store.clear()
+        self.store.extend(paths, types)
+        self.endResetModel()
+
+    def renameRows(self, newPaths):
+        """Give rows new paths without moving them, using a dict of row ->
+        new path."""
+        if not newPaths:
+            return
+        for row, path in newPaths.items():
+            self.store.rename(row, path)
+        self.dataChanged.emit(self.index(min(newPaths)), self.index(max(newPaths)), [])
+
+    def moveRows(self, sourceParent, sourceRow, count, destParent, destChild):
+        if sourceParent.isValid() or destParent.isValid() or count <= 0:
+            return False
+        last = sourceRow + count - 1
+        if sourceRow <= destChild <= last + 1:
+            # Moving a block onto itself is a no-op
+            return False
+        self.beginMoveRows(sourceParent, sourceRow, last, destParent, destChild)
+        rows = self.store.take(sourceRow, last)
+        if destChild > last:
+            destChild -= count
+        self.store.insert(destChild, rows)
+        self.endMoveRows()
+        return True
+
+    def removeRows(self, row, count, parent=QtCore.QModelIndex()):
+        if parent.isValid() or count <= 0:
+            return False
+        self.beginRemoveRows(parent, row, row + count - 1)
+        self.store.remove(row, row + count - 1)
+        self.endRemoveRows()
+        return True
+
+    def clear(self):
+        self.beginResetModel()
+        self.store.clear()
+        self.endResetModel()
+
+    def sort(self, column=0, order=QtCore.Qt.AscendingOrder):
+        reverse = order == QtCore.Qt.DescendingOrder
+        with tracing.span("sort", files=len(self.store)):
+            keys = self.rowSortKeys()
+            self.reorder(self.store.sortOrder(key=keys.__getitem__, reverse=reverse))
+
+    def rowSortKeys(self):
+        """The key of every row for sorting with the current sortOptions."""
+        options = self.sortOptions
+        get = self.sortKeys.get
+        store = self.store
+        rows = range(len(store))
+        keys = [get(store.displayName(row), options) for row in rows]
+        if not options.byDirectory:
+            return keys
+        # There are far fewer folders than files, so sort them on their own
+        # and put each one's position in front of its files' keys
+        dirs = sorted({store.dir(row) for row in rows}, key=lambda d: get(d, options))
+        prefix = {d: f"{i:08x}" for i, d in enumerate(dirs)}
+        return [prefix[store.dir(row)] + key for row, key in zip(rows, keys)]
+
+    def reorder(self, order):
+        """Rearrange all rows at once so new row i is old row order[i]."""
+        self.layoutAboutToBeChanged.emit()
+        self.store.reorder(order)
+        # Keep selections etc. pointing at the same files
+        newRow = [0] * len(order)
+        for new, old in enumerate(order):
+            newRow[old] = new
+        oldIdxs = self.persistentIndexList()
+        newIdxs = [self.index(newRow[i.row()], 0) for i in oldIdxs]
+        self.changePersistentIndexList(oldIdxs, newIdxs)
+        self.layoutChanged.emit()
+
+    def shiftRows(self, ranges, dir):
+        """Move each (first, last) block of rows, as from mergeRanges, up
+        (dir -1) or down (dir 1) by one. Blocks already at the top or bottom
+        stay where they are. Returns where the blocks ended up."""
+        n = len(self.store)
+        order = list(range(n))
+        newRanges = []
+        for first, last in ranges:
+            # Blocks are separated by at least one other row, so each one
+            # just swaps places with the row next to it
+            if dir < 0 and first > 0:
+                order[first - 1 : last + 1] = order[first : last + 1] + [first - 1]
+                first, last = first - 1, last - 1
+            elif dir > 0 and last < n - 1:
+                order[first : last + 2] = [last + 1] + order[first : last + 1]
+                first, last = first + 1, last + 1
+            newRanges.append([first, last])
+        if newRanges != ranges:
+            self.reorder(order)
+        return newRanges
+
+    def moveRowsTo(self, ranges, dest):
+        """Move blocks of rows so they end up together, in order, in front of
+        what is currently at row dest. Returns where they ended up."""
+        n = len(self.store)
+        rows = [r for first, last in ranges for r in range(first, last + 1)]
+        # Where dest ends up once the moved rows are taken out
+        start = dest - sum(
+            min(last + 1, dest) - first for first, last in ranges if first < dest
+        )
+        rest = []
+        prev = 0
+        for first, last in ranges:
+            rest.extend(range(prev, first))
+            prev = last + 1
+        rest.extend(range(prev, n))
+        order = rest[:start] + rows + rest[start:]
+        if rows:
+            self.reorder(order)
+            return [[start, start + len(rows) - 1]]
+        return []
+
+    def removeRowSet(self, rows):
+        """Remove the given row numbers, in any order."""
+        self.removeRowList(mergeRanges((r, r) for r in rows))
+
+    def removeRowList(self, ranges):
+        """Remove blocks of rows, as from mergeRanges."""
+        if len(ranges) <= MAX_REMOVE_RANGES:
+            # Remove from the bottom up so the rows don't shift under us
+            for first, last in reversed(ranges):
+                self.removeRows(first, last - first + 1)
+        else:
+            self.beginResetModel()
+            self.store.removeRanges(ranges)
+            self.endResetModel()
+
+
+class ScanWorker(QtCore.QThread):
+    """Scans a directory tree in the background, sending the files it finds
+    back in batches."""
+
+    # (paths, number of files found so far, number of directories scanned)
+    batchReady = QtCore.Signal(list, int, int)
+
+    def __init__(self, dir, parent=None):
+        super().__init__(parent)
+        self.dir = dir
+        self.cancelled = False
+        # The progress dialog showing this scan, set by CustomList
+        self.progress = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        found = 0
+        # Loading the cache can take a moment, so it's done here rather than
+        # on the UI thread
+        cache = scanCache.shared()
+        for paths, dirs in scanTree(self.dir, lambda: self.cancelled, cache=cache):
+            found += len(paths)
+            self.batchReady.emit(paths, found, dirs)
+        cache.save()
+
+
+class CustomList(QtWidgets.QListView):
     def __init__(self):
         super().__init__()
+        self.setModel(FileListModel(self))
         self.setAcceptDrops(True)
         self.setDragEnabled(True)
         self.setDragDropMode(QtWidgets.QAbstractItemView.InternalMove)
         self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.setAlternatingRowColors(True)
+        # Every row is one line of text, so Qt doesn't need to measure each one
+        self.setUniformItemSizes(True)
+        # Lay out long lists a chunk at a time between events, so the window
+        # stays responsive after rows are added or moved
+        self.setLayoutMode(QtWidgets.QListView.Batched)
+        self.setBatchSize(LAYOUT_BATCH_SIZE)
+        # Follow files that are renamed or deleted outside of the program
+        self.watcher = DirWatcher(self.model(), self)
+        # ScanWorkers that haven't finished yet
+        self.scanWorkers = []
+        # The ranges last given to selectRanges, so moving a big selection
+        # again doesn't have to read it back out of Qt. Anything else that
+        # changes the selection or the rows forgets them.
+        self.ranges = None
+        self.selectionModel().selectionChanged.connect(self.forgetRanges)
+        model = self.model()
+        for signal in (
+            model.rowsInserted,
+            model.rowsRemoved,
+            model.rowsMoved,
+            model.layoutChanged,
+            model.modelReset,
+        ):
+            signal.connect(self.forgetRanges)
+
+    def count(self):
+        return self.model().rowCount()
+
+    def path(self, row):
+        return self.model().path(row)
+
+    def paths(self):
+        """Full paths of every item in the list, in order."""
+        return self.model().paths()
 
     def addFilenames(self, filePaths):
         """filePaths has to be a list."""
-        fnames = []
-        for f in filePaths:
-            bn = os.path.basename(f)
-            if os.path.isdir(f):
-                bn = bn + "/"
-            fnames.append(bn)
-        items = [QtWidgets.QListWidgetItem(f) for f in fnames]
-        for i, fullPath in zip(items, filePaths):
-            # Store the full path of the item in its tooltip
-            i.setToolTip(fullPath)
-            self.addItem(i)
+        self.addPaths(filePaths)
+
+    def addPaths(self, paths, isDirs=None):
+        """Add many paths at once, skipping ones already in the list. See
+        FileListModel.addPaths."""
+        self.setUpdatesEnabled(False)
+        try:
+            return self.model().addPaths(paths, isDirs)
+        finally:
+            self.setUpdatesEnabled(True)
+
+    def replacePaths(self, newPaths):
+        self.model().replacePaths(newPaths)
+
+    def forgetRanges(self, *args):
+        self.ranges = None
+
+    def selectedRanges(self):
+        """The selected rows as merged (first, last) ranges."""
+        if self.ranges is not None:
+            return [list(r) for r in self.ranges]
+        selection = self.selectionModel().selection()
+        return mergeRanges((r.top(), r.bottom()) for r in selection)
+
+    def selectRanges(self, ranges):
+        """Select the rows in merged (first, last) ranges, as from
+        selectedRanges, instead of what was selected before."""
+        # createIndex skips the row count check model.index does for every
+        # call, which is most of the time for a scattered selection
+        createIndex = self.model().createIndex
+        selection = QtCore.QItemSelection()
+        for first, last in ranges:
+            selection.select(createIndex(first, 0), createIndex(last, 0))
+        selectionModel = self.selectionModel()
+        # The view works out what to repaint one selection range at a time,
+        # which is slow for thousands of ranges, so just repaint everything
+        selectionModel.blockSignals(True)
+        try:
+            selectionModel.select(selection, QtCore.QItemSelectionModel.ClearAndSelect)
+        finally:
+            selectionModel.blockSignals(False)
+        self.ranges = [tuple(r) for r in ranges]
+        self.viewport().update()
+
+    def moveSelection(self, move):
+        """Run move(ranges) on the selected rows, where move rearranges the
+        rows and returns where the selected ones ended up.
+
+        The selection is cleared while the rows move and put back after,
+        since Qt would otherwise track every selected row on its own.
+        """
+        ranges = self.selectedRanges()
+        if not ranges:
+            return
+        self.selectRanges([])
+        self.selectRanges(move(ranges))
 
     def dragEnterEvent(self, event):
         # If dragging a file, accept it, otherwise do default behavior
@@ -41,14 +387,38 @@ class CustomList(QtWidgets.QListWidget):
         else:
             super().dragEnterEvent(event)
 
+    def dragMoveEvent(self, event):
+        if event.mimeData().hasUrls():
+            event.accept()
+        else:
+            super().dragMoveEvent(event)
+
     def dropEvent(self, event):
-        # If dropping a file, add it to the list, otherwise do default behavior
+        # If dropping a file, add it to the list
         if event.mimeData().hasUrls():
             files = [u.toLocalFile() for u in event.mimeData().urls()]
             self.addFilenames(files)
+        elif event.source() is self:
+            # Moving items around inside the list
+            dest = self.dropRow(event)
+            self.moveSelection(lambda r: self.model().moveRowsTo(r, dest))
+            # Report a copy so the view doesn't also remove the dragged rows
+            event.setDropAction(QtCore.Qt.CopyAction)
+            event.accept()
         else:
             super().dropEvent(event)
 
+    def dropRow(self, event):
+        """Row that dropped items should be inserted in front of."""
+        pos = event.position().toPoint()
+        idx = self.indexAt(pos)
+        if not idx.isValid():
+            return self.count()
+        rect = self.visualRect(idx)
+        if pos.y() >= rect.center().y():
+            return idx.row() + 1
+        return idx.row()
+
     def mousePressEvent(self, event):
         # Deselect currently selected item if the click wasn't on an item
         pos = event.position()
@@ -56,8 +426,8 @@ class CustomList(QtWidgets.QListWidget):
         idx = self.indexAt(pt)
         super().mousePressEvent(event)
         if not idx.isValid():
-            self.setCurrentRow(-1)
-            self.setCurrentItem(None)
+            self.clearSelection()
+            self.setCurrentIndex(QtCore.QModelIndex())
 
     def openFileDialog(self):
         files = QtWidgets.QFileDialog.getOpenFileNames()[0]
@@ -65,49 +435,88 @@ class CustomList(QtWidgets.QListWidget):
 
     def openRecursiveDirDialog(self):
         dir = QtWidgets.QFileDialog.getExistingDirectory()
-        fileList = []
-        for root, dirs, files in os.walk(dir):
-            for filename in files:
-                fileList.append(os.path.join(root, filename))
-        fileList.sort()
-        self.addFilenames(fileList)
+        if dir:
+            self.scanDirectory(dir)
+
+    def scanDirectory(self, dir):
+        """Add every file under dir to the list without blocking the UI.
+        Files show up as they're found; cancelling keeps what was found.
+        Several scans can run at once, each with its own progress dialog."""
+        self.watcher.addRoot(dir)
+        worker = ScanWorker(dir, self)
+        worker.progress = QtWidgets.QProgressDialog(
+            "Looking for files...", "Cancel", 0, 0, self
+        )
+        worker.progress.setWindowTitle(self.window().windowTitle())
+        worker.progress.setWindowModality(QtCore.Qt.WindowModal)
+        # Busy indicator that only pops up if the scan takes a while
+        worker.progress.setAutoReset(False)
+        worker.progress.setAutoClose(False)
+        worker.progress.setMinimumDuration(500)
+        worker.progress.setValue(0)
+        worker.progress.canceled.connect(worker.cancel)
+        worker.batchReady.connect(self.addScannedFiles)
+        worker.finished.connect(self.scanFinished)
+        self.scanWorkers.append(worker)
+        worker.start()
+
+    def addScannedFiles(self, paths, found, dirs):
+        # The scanner only sends back files, so there's nothing to stat
+        self.addPaths(paths, dict.fromkeys(paths, False))
+        self.sender().progress.setLabelText(f"Found {found} files in {dirs} folders...")
+
+    def scanFinished(self):
+        worker = self.sender()
+        self.scanWorkers.remove(worker)
+        # close() would count as cancelling, so just hide it
+        worker.progress.hide()
+        worker.progress.deleteLater()
+        worker.deleteLater()
+
+    def stopScans(self):
+        """Cancel any scans still running and wait for their threads to end,
+        so they aren't destroyed while running when the window closes. The
+        watcher's listing is waited for too."""
+        for worker in self.scanWorkers:
+            worker.cancel()
+        for worker in self.scanWorkers:
+            worker.wait()
+        self.watcher.stop()
+
+    def sortItems(self):
+        self.model().sort(0)
+
+    def sortMenu(self):
+        """Menu of the ways sortItems can sort, for the sort button."""
+        menu = QtWidgets.QMenu(self)
+        options = self.model().sortOptions
+        for label, field in (
+            ("Sort numbers by value", "natural"),
+            ("Ignore case", "caseFold"),
+            ("Sort by folder, then name", "byDirectory"),
+        ):
+            action = menu.addAction(label)
+            action.setCheckable(True)
+            action.setChecked(getattr(options, field))
+            action.toggled.connect(
+                lambda checked, field=field: self.setSortOption(field, checked)
+            )
+        return menu
+
+    def setSortOption(self, field, value):
+        """Change one of the SortOptions and sort the list with it."""
+        model = self.model()
+        model.sortOptions = model.sortOptions._replace(**{field: value})
+        self.sortItems()
 
     def move(self, dir):
-        """dir is 1 if moving down and -1 if moving up, so bool(dir+1) is
-        true if moving down and false if moving up."""
-        n = self.count()
-        items = self.selectedItems()
-        if len(items) > 0:
-            rows = []
-            # Placed keeps track of the items which have already moved. If an
-            # item tries to move into one of the ones that has already moved
-            # then it's at one of the edges and it shouldn't keep going.
-            placed = []
-            # Get rows of selected items
-            for i in items:
-                idx = self.indexFromItem(i)
-                rows.append(idx.row())
-            # Sort them so not to mess up indices during the move.
-            # Reverse or not depending on direction of move
-            rows.sort(reverse=bool(dir + 1))
-            for row in rows:
-                if row + dir >= 0 and row + dir < n and row + dir not in placed:
-                    new = row + dir
-                else:
-                    new = row
-                itm = self.takeItem(row)
-                self.insertItem(new, itm)
-                placed.append(new)
-                # Keep all the items selected after they're moved
-                itm.setSelected(True)
-            self.setCurrentItem(itm)
+        """dir is 1 if moving down and -1 if moving up."""
+        self.moveSelection(lambda r: self.model().shiftRows(r, dir))
 
     def remove(self):
-        items = self.selectedItems()
-        for i in items:
-            idx = self.indexFromItem(i)
-            self.takeItem(idx.row())
+        ranges = self.selectedRanges()
+        self.selectRanges([])
+        self.model().removeRowList(ranges)
 
     def clear(self):
-        for _ in range(self.count()):
-            self.takeItem(0)
+        self.model().clear()
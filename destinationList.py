@@ -0,0 +1,211 @@
+# Read-only list shown next to the files to be renamed, giving the name each
+# one will get with the current templates, suffixes and list order. Names are
+# worked out only for the rows being painted, and the template stems and file
+# extensions they're built from are cached, so typing in a suffix box only
+# redoes the rows that use that suffix. When files are matched to templates
+# by episode number, the pairing comes from tokenMatcher instead of the list
+# order; it's worked out once for the whole list whenever either list
+# changes.
+
+# https://doc.qt.io/qtforpython/PySide6/QtCore/QAbstractListModel.html
+
+import os
+from PySide6 import QtCore, QtWidgets, QtGui
+import renameCore
+import tokenMatcher
+
+# Forget the cached names once this many have piled up from scrolling around
+MAX_CACHED_NAMES = 20000
+
+
+class DestinationModel(QtCore.QAbstractListModel):
+    def __init__(self, leftModel, rightModel, suffixes, parent=None):
+        """leftModel and rightModel are the FileListModels of the template
+        and target lists. suffixes is a function returning the current list
+        of suffixes."""
+        super().__init__(parent)
+        self.leftModel = leftModel
+        self.rightModel = rightModel
+        self.suffixes = suffixes
+        self.currentSuffixes = suffixes()
+        # namingRules.NamingRule to build the names with, or None for
+        # renameCore.newFilename. ruleOk is False while the rule being typed
+        # in isn't valid, and no names are shown.
+        self.rule = None
+        self.ruleOk = True
+        # Whether files are matched to templates by episode number, and if
+        # so, row -> (template row, suffix number, index, fileindex) for the
+        # rows that get renamed, worked out when first needed
+        self.matching = False
+        self.places = None
+        # Row -> template stem, row -> target extension, row -> new name
+        self.stems = {}
+        self.exts = {}
+        self.names = {}
+        for signal in (
+            leftModel.rowsInserted,
+            leftModel.rowsRemoved,
+            leftModel.rowsMoved,
+            leftModel.layoutChanged,
+            leftModel.modelReset,
+            leftModel.dataChanged,
+        ):
+            signal.connect(self.templatesChanged)
+        for signal in (
+            rightModel.rowsInserted,
+            rightModel.rowsRemoved,
+            rightModel.rowsMoved,
+            rightModel.layoutChanged,
+            rightModel.modelReset,
+            rightModel.dataChanged,
+        ):
+            signal.connect(self.targetsChanged)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.rightModel.rowCount()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self.name(index.row())
+        return None
+
+    def flags(self, index):
+        return QtCore.Qt.ItemIsEnabled
+
+    def stem(self, templateRow):
+        stem = self.stems.get(templateRow)
+        if stem is None:
+            name = self.leftModel.store.name(templateRow)
+            stem = self.stems[templateRow] = os.path.splitext(name)[0]
+        return stem
+
+    def ext(self, row):
+        ext = self.exts.get(row)
+        if ext is None:
+            name = self.rightModel.store.name(row)
+            ext = self.exts[row] = os.path.splitext(name)[1]
+        return ext
+
+    def place(self, row):
+        """(template row, suffix number, index, fileindex) for a target row,
+        the way the rename will pair them, or None if it won't be renamed."""
+        n = len(self.currentSuffixes)
+        if not self.matching:
+            templateRow = row // n
+            if templateRow >= self.leftModel.rowCount():
+                # More files than templates
+                return None
+            return templateRow, row % n, templateRow + 1, row + 1
+        if self.places is None:
+            result = tokenMatcher.matchFiles(
+                self.leftModel.paths(), self.rightModel.paths(), n
+            )
+            # Numbered the way renameCore counts them after
+            # tokenMatcher.matchedLists has dropped incomplete templates
+            self.places = {}
+            for index, (templateRow, group) in enumerate(result.groups, 1):
+                for k, target in enumerate(group):
+                    self.places[target] = (
+                        templateRow,
+                        k,
+                        index,
+                        (index - 1) * n + k + 1,
+                    )
+        return self.places.get(row)
+
+    def name(self, row):
+        name = self.names.get(row)
+        if name is None:
+            if not self.ruleOk:
+                return ""
+            place = self.place(row)
+            if place is None:
+                return ""
+            templateRow, k, index, fileIndex = place
+            if len(self.names) >= MAX_CACHED_NAMES:
+                self.names.clear()
+            stem, suffix = self.stem(templateRow), self.currentSuffixes[k]
+            if self.rule is None:
+                name = renameCore.newFilename(stem, suffix, self.ext(row))
+            else:
+                source = os.path.splitext(self.rightModel.store.name(row))[0]
+                name = self.rule(stem, suffix, self.ext(row), source, index, fileIndex)
+            self.names[row] = name
+        return name
+
+    def refresh(self):
+        # The view only repaints the rows it shows
+        n = self.rowCount()
+        if n:
+            self.dataChanged.emit(self.index(0), self.index(n - 1))
+
+    def setRule(self, rule, ok=True):
+        self.rule = rule
+        self.ruleOk = ok
+        self.names.clear()
+        self.refresh()
+
+    def setMatching(self, matching):
+        """Pair files with templates by episode number if matching is set,
+        otherwise by their order in the lists."""
+        self.matching = matching
+        self.places = None
+        self.names.clear()
+        self.refresh()
+
+    def templatesChanged(self):
+        self.stems.clear()
+        self.names.clear()
+        self.places = None
+        self.refresh()
+
+    def targetsChanged(self):
+        self.beginResetModel()
+        self.exts.clear()
+        self.names.clear()
+        self.places = None
+        self.endResetModel()
+
+    def suffixCountChanged(self):
+        self.currentSuffixes = self.suffixes()
+        self.names.clear()
+        self.places = None
+        self.refresh()
+
+    def suffixChanged(self, i):
+        """Suffix box i was edited; only rows using that suffix change."""
+        self.currentSuffixes = self.suffixes()
+        for row in [r for r in self.names if self.place(r)[1] == i]:
+            del self.names[row]
+        self.refresh()
+
+
+class DestinationList(QtWidgets.QListView):
+    """Shows a DestinationModel, scrolling along with the list it's next to."""
+
+    def __init__(self, model, targetList):
+        super().__init__()
+        self.setModel(model)
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(targetList.layoutMode())
+        self.setBatchSize(targetList.batchSize())
+        self.setAlternatingRowColors(True)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        self.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        # Gray text, since these aren't files yet
+        palette = self.palette()
+        palette.setColor(
+            QtGui.QPalette.Text, palette.color(QtGui.QPalette.PlaceholderText)
+        )
+        self.setPalette(palette)
+        # Keep both lists scrolled to the same rows
+        ours = self.verticalScrollBar()
+        theirs = targetList.verticalScrollBar()
+        theirs.valueChanged.connect(ours.setValue)
+        theirs.rangeChanged.connect(lambda: ours.setValue(theirs.value()))
+        ours.valueChanged.connect(theirs.setValue)
@@ -0,0 +1,101 @@
+# Recursive directory scanning with os.scandir. Files come out in batches so
+# a caller can show them while the rest of the tree is still being read, and
+# the file type information from each DirEntry is reused instead of stat'ing
+# every path again. With a scanCache.ScanCache, directories that haven't
+# changed since the last scan aren't read again at all.
+
+import os
+import time
+import tracing
+
+# Hand back found files once there are this many of them...
+BATCH_SIZE = 2000
+# ...or once this many seconds have passed, whichever comes first
+BATCH_INTERVAL = 0.2
+
+
+def _isDir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def _readDir(path):
+    """The names in path, sorted, with a trailing slash on directories.
+    Symlinks to directories are left out."""
+    tracing.count("directories scanned")
+    names = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if not _isDir(entry):
+                    names.append(entry.name)
+                elif not entry.is_symlink():
+                    names.append(entry.name + "/")
+    except OSError:
+        # Unreadable directories are skipped, like os.walk does
+        return []
+    # The trailing slash makes a depth first walk come out in the same order
+    # as sorting the full paths of every file
+    names.sort()
+    return names
+
+
+def _listDir(path, cache):
+    if cache is None:
+        return _readDir(path)
+    tracing.count("stat calls")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return []
+    names = cache.get(path, mtime)
+    if names is None:
+        names = _readDir(path)
+        cache.put(path, mtime, names)
+    else:
+        tracing.count("directories from cache")
+    return names
+
+
+def scanTree(
+    top, isCancelled=None, batchSize=BATCH_SIZE, interval=BATCH_INTERVAL, cache=None
+):
+    """Find every file under top, in sorted order.
+
+    Yields (paths, dirsScanned) tuples, where paths is a list of file paths
+    found since the last batch and dirsScanned is the total number of
+    directories read so far. Symlinks to directories aren't followed.
+    isCancelled is an optional function that's checked between entries; the
+    scan stops early if it returns true. cache is an optional
+    scanCache.ScanCache to reuse the listings of unchanged directories from.
+    """
+    # The span also covers the time spent by whoever is consuming the batches
+    with tracing.span("scan", top=top):
+        stack = [(top, iter(_listDir(top, cache)))]
+        dirsScanned = 1
+        batch = []
+        lastYield = time.monotonic()
+        while stack:
+            if isCancelled is not None and isCancelled():
+                break
+            dir, names = stack[-1]
+            name = next(names, None)
+            if name is None:
+                stack.pop()
+                continue
+            path = os.path.join(dir, name.rstrip("/"))
+            if name.endswith("/"):
+                stack.append((path, iter(_listDir(path, cache))))
+                dirsScanned += 1
+                continue
+            batch.append(path)
+            if len(batch) >= batchSize or time.monotonic() - lastYield >= interval:
+                tracing.count("files scanned", len(batch))
+                yield batch, dirsScanned
+                batch = []
+                lastYield = time.monotonic()
+        if batch:
+            tracing.count("files scanned", len(batch))
+            yield batch, dirsScanned
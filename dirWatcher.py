@@ -0,0 +1,305 @@
+# Keeps a FileListModel in step with the files on disk. The directories the
+# listed files are in are watched with QFileSystemWatcher (inotify on Linux),
+# and when one changes only the rows for files in that directory are touched:
+# files that are gone are removed, files that were renamed get their new name
+# in place, and new files are added if the directory was added as a whole
+# folder. Change notifications come in bursts, so they're collected and
+# handled together once things quiet down. Listing the directories happens on
+# a worker thread, since on a network share each one is a round trip; the
+# rows are only looked up and changed back on the UI thread.
+#
+# Renames are told apart from deletions by inode number. When a directory is
+# first watched, the inodes of the listed files in it are noted, so a file
+# that disappears can be found again under its new name.
+
+# https://doc.qt.io/qtforpython/PySide6/QtCore/QFileSystemWatcher.html
+
+import os
+import time
+from PySide6 import QtCore
+from dirScanner import scanTree
+import tracing
+
+# Handle changes once nothing has changed for this long...
+DEBOUNCE_MS = 250
+# ...but don't put them off for longer than this if changes keep coming
+MAX_DELAY_MS = 2000
+
+
+def _listDir(path):
+    """{name: (inode, isDir, isLink)} for everything in path, or None if it
+    can't be read."""
+    listing = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    listing[entry.name] = (
+                        entry.inode(),
+                        entry.is_dir(),
+                        entry.is_symlink(),
+                    )
+                except OSError:
+                    pass
+    except OSError:
+        return None
+    return listing
+
+
+class ListWorker(QtCore.QThread):
+    """Lists directories off the UI thread for a DirWatcher."""
+
+    def __init__(self, dirs, roots, watched, parent=None):
+        """dirs are the directories to list. New folders found in the ones
+        in roots are scanned for files, except ones already in watched."""
+        super().__init__(parent)
+        self.dirs = dirs
+        self.roots = roots
+        self.watched = watched
+        # {directory: _listDir result}
+        self.listings = {}
+        # {directory: files found in new folders directly inside it}
+        self.newFiles = {}
+
+    def run(self):
+        for d in self.dirs:
+            listing = self.listings[d] = _listDir(d)
+            if listing is None or d not in self.roots:
+                continue
+            found = []
+            for name, (ino, isDir, isLink) in sorted(listing.items()):
+                path = os.path.join(d, name)
+                if isDir and not isLink and path not in self.watched:
+                    # A new folder; its files are found the same way a scan
+                    # would
+                    for paths, dirs in scanTree(path):
+                        found.extend(paths)
+            self.newFiles[d] = found
+
+
+class DirWatcher(QtCore.QObject):
+    def __init__(self, model, parent=None):
+        """model is the FileListModel to keep up to date."""
+        super().__init__(parent)
+        self.model = model
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.directoryChanged)
+        # directory -> {name: inode} for the listed files in it
+        self.inodes = {}
+        # Folders added as a whole, whose new files belong in the list too
+        self.roots = set()
+        # Directories waiting to be looked at, and ones that still need
+        # their inodes noted
+        self.dirty = set()
+        self.unsnapshotted = set()
+        self.firstChange = None
+        self.paused = False
+        # The ListWorker listing directories, if any, and for each directory
+        # it's updating, the names of the rows in it when it started. Only
+        # those rows can be judged by its listings.
+        self.worker = None
+        self.known = {}
+        # The directories it's noting the inodes of
+        self.snapshot = set()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(DEBOUNCE_MS)
+        self.timer.timeout.connect(self.flush)
+        model.rowsInserted.connect(self.rowsInserted)
+        model.modelReset.connect(self.modelReset)
+
+    def addRoot(self, dir):
+        """Treat new files anywhere under dir as part of the list."""
+        self.roots.add(os.path.normpath(dir))
+        self.watch([dir])
+
+    def underRoot(self, dir):
+        dir = os.path.normpath(dir)
+        while True:
+            if dir in self.roots:
+                return True
+            parent = os.path.dirname(dir)
+            if parent == dir:
+                return False
+            dir = parent
+
+    def pause(self):
+        """Stop applying changes, e.g. while the files are being renamed by
+        us. Changes are still collected."""
+        self.paused = True
+        self.timer.stop()
+
+    def resume(self):
+        self.paused = False
+        if self.dirty or self.unsnapshotted:
+            self.schedule()
+
+    def stop(self):
+        """Wait for the directories being listed, before the list goes away."""
+        self.timer.stop()
+        if self.worker is not None:
+            self.worker.wait()
+
+    def watch(self, dirs):
+        new = [d for d in dirs if d not in self.inodes]
+        if not new:
+            return
+        for d in new:
+            self.inodes[d] = {}
+        # Noting the inodes means listing each directory, which is left for
+        # the worker so adding files stays fast
+        self.unsnapshotted.update(new)
+        self.watcher.addPaths([d or "." for d in new])
+        self.schedule()
+
+    def unwatch(self, dir):
+        self.inodes.pop(dir, None)
+        self.unsnapshotted.discard(dir)
+        self.watcher.removePath(dir or ".")
+
+    def rowsInserted(self, parent, first, last):
+        store = self.model.store
+        self.watch({store.dir(row) for row in range(first, last + 1)})
+
+    def modelReset(self):
+        if not self.model.rowCount():
+            # Cleared
+            if self.inodes:
+                self.watcher.removePaths([d or "." for d in self.inodes])
+            self.inodes.clear()
+            self.roots.clear()
+            self.dirty.clear()
+            self.unsnapshotted.clear()
+            # Whatever the worker finds no longer applies
+            self.known.clear()
+            return
+        store = self.model.store
+        self.watch({store.dir(row) for row in range(len(store))})
+
+    def directoryChanged(self, path):
+        if path == ".":
+            path = ""
+        self.dirty.add(path)
+        self.schedule()
+
+    def schedule(self):
+        if self.paused or self.worker is not None:
+            # Whatever is still to do gets scheduled when the worker is done
+            return
+        now = time.monotonic()
+        if not self.timer.isActive():
+            self.firstChange = now
+            self.timer.start()
+        elif (now - self.firstChange) * 1000 < MAX_DELAY_MS:
+            # Restart the countdown
+            self.timer.start()
+
+    def flush(self):
+        """Hand the directories waiting to be looked at to a ListWorker."""
+        if self.paused or self.worker is not None:
+            return
+        dirty, self.dirty = self.dirty, set()
+        snapshot, self.unsnapshotted = self.unsnapshotted - dirty, set()
+        if not (dirty or snapshot):
+            return
+        store = self.model.store
+        self.known = {d: set(store.namesIn(d)) for d in dirty}
+        roots = {d for d in dirty if self.underRoot(d)}
+        self.snapshot = snapshot
+        self.worker = ListWorker(
+            list(dirty | snapshot), roots, frozenset(self.inodes), self
+        )
+        self.worker.finished.connect(self.listed)
+        self.worker.start()
+
+    def listed(self):
+        worker, self.worker = self.worker, None
+        worker.deleteLater()
+        known, self.known = self.known, {}
+        if self.paused:
+            # The files may be moving under us; look again after
+            self.dirty.update(known)
+            self.unsnapshotted.update(self.snapshot)
+            return
+        with tracing.span("watch update", dirs=len(worker.listings)):
+            self.apply(known, worker)
+        if self.dirty or self.unsnapshotted:
+            self.schedule()
+
+    def apply(self, known, worker):
+        """Change the rows to match what worker found."""
+        store = self.model.store
+        for d in self.snapshot:
+            if d not in self.inodes:
+                continue
+            listing = worker.listings[d] or {}
+            self.inodes[d] = {
+                name: listing[name][0] for name in store.namesIn(d) if name in listing
+            }
+        # Work out what happened by name first, so the rows only have to be
+        # looked for if some files really are gone
+        gone = {}
+        moves = {}
+        added = []
+        for d, names in known.items():
+            if d in self.inodes:
+                self.update(d, names, worker, gone, moves, added)
+        rows = store.findRows(gone) if gone else {}
+        removed = []
+        renamed = {}
+        for d, names in gone.items():
+            for name in names:
+                row = rows.get((d, name))
+                if row is None:
+                    continue
+                if (d, name) in moves:
+                    renamed[row] = moves[d, name]
+                else:
+                    removed.append(row)
+        self.model.renameRows(renamed)
+        if removed:
+            self.model.removeRowSet(removed)
+        if added:
+            self.model.addPaths(added, dict.fromkeys(added, False))
+
+    def update(self, dir, known, worker, gone, moves, added):
+        """Work out what happened to the listed files in dir, adding to the
+        {directory: names} of files that are gone, the {(directory, name):
+        new path} of the ones that were renamed and the list of added
+        paths. known are the names of the rows in dir when it was listed."""
+        listing = worker.listings[dir]
+        names = self.model.store.namesIn(dir)
+        if listing is None:
+            # The directory itself is gone
+            gone[dir] = known & names
+            self.unwatch(dir)
+            return
+        underRoot = dir in worker.roots
+        if not names and not underRoot:
+            self.unwatch(dir)
+            return
+        old = self.inodes.get(dir, {})
+        byInode = {entry[0]: name for name, entry in listing.items()}
+        listed = set(names)
+        inodes = {}
+        missing = set()
+        for name in names:
+            if name in listing:
+                inodes[name] = listing[name][0]
+            elif name in known:
+                missing.add(name)
+        for name in sorted(missing):
+            newName = byInode.get(old.get(name))
+            if newName is not None and newName not in listed:
+                moves[dir, name] = os.path.join(dir, newName)
+                listed.add(newName)
+                inodes[newName] = listing[newName][0]
+        if missing:
+            gone[dir] = missing
+        if underRoot:
+            for name, (ino, isDir, isLink) in sorted(listing.items()):
+                if name not in listed and not isDir:
+                    added.append(os.path.join(dir, name))
+                    inodes[name] = ino
+            added.extend(worker.newFiles.get(dir, []))
+        self.inodes[dir] = inodes
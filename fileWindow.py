@@ -9,17 +9,28 @@ import os
 import sys
 from PySide6 import QtCore, QtWidgets, QtGui
 from customList import CustomList
+from icons import icon
+import namingRules
+from destinationList import DestinationModel, DestinationList
 
 # https://doc.qt.io/qtforpython/PySide6/QtWidgets/index.html#list-of-classes
 
+# Tooltip for the naming rule box while the rule is valid
+RULE_HELP = (
+    "Fields: {stem} {suffix} {ext} {source} {index} {fileindex}, "
+    "{t1}.. and {s1}.. from the patterns.\n"
+    "Add a format like {index:03d} or a case change like {stem!u} "
+    "(!u, !l, !t, !c)."
+)
+
 
 # todo:
-# - add an option to specify destination path? so files are copied instead of
-#   renamed in place
 # - progress bar?
 # - add a tick box to the warning message to give the option of never showing it again
 
 # recently done:
+# - option to copy the files into a destination folder instead of renaming
+#   them in place
 # - add a warning about moving files being dangerous
 # - code changes:
 # -- long strings split into multiple lines
@@ -40,16 +51,15 @@ class FileWindow(QtWidgets.QWidget):
         self.compactSizePolicy = QtWidgets.QSizePolicy(maxs, maxs)
         # Only stretch horizontally
         self.compactVertSizePolicy = QtWidgets.QSizePolicy(mins, maxs)
-        previewIcon = QtGui.QIcon("icons/preview.svg")
         # Filenames can't contain certain characters
         filenameRegex = QtCore.QRegularExpression(r'[^<>:"/\\\|\?\*]*')
-        filenameValidator = QtGui.QRegularExpressionValidator(filenameRegex)
+        self.filenameValidator = QtGui.QRegularExpressionValidator(filenameRegex)
 
         ###############
         # SETTINGS
-        boxesPerRow = 2
+        self.boxesPerRow = 2
         numOfBoxCols = 5
-        maxTargetFiles = boxesPerRow * numOfBoxCols
+        maxTargetFiles = self.boxesPerRow * numOfBoxCols
         self.settingsLayout = QtWidgets.QVBoxLayout()
         # Use a frame in order to set size policy
         self.spinboxFrame = QtWidgets.QFrame()
@@ -79,25 +89,51 @@ class FileWindow(QtWidgets.QWidget):
         self.suffixBoxFrame.setSizePolicy(self.compactVertSizePolicy)
         self.suffixBoxLayout = QtWidgets.QGridLayout(self.suffixBoxFrame)
         self.suffixBoxLayout.setContentsMargins(0, 0, 0, 0)
-        for i in range(maxTargetFiles):
-            # Create suffix input boxes and store them in suffixBoxes
-            suffixFrame = QtWidgets.QFrame()
-            suffixLayout = QtWidgets.QHBoxLayout(suffixFrame)
-            suffixLayout.setContentsMargins(0, 0, 0, 0)
-            suffix = QtWidgets.QLineEdit()
-            suffix.setValidator(filenameValidator)
-            suffixLabel = QtWidgets.QLabel(f"File {i+1} Suffix:")
-            suffixLayout.addWidget(suffixLabel)
-            suffixLayout.addWidget(suffix)
-            self.suffixBoxLayout.addWidget(
-                suffixFrame, i // boxesPerRow, i % boxesPerRow
-            )
-            self.suffixFrames.append(suffixFrame)
-            self.suffixBoxes.append(suffix)
-        for s in self.suffixFrames[1:]:
-            # Hide them all except the first one
-            s.setVisible(False)
+        # Only the first box is made now, the rest when the spinbox needs them
+        self.addSuffixBox()
         self.settingsLayout.addWidget(self.suffixBoxFrame)
+        # Pair files by the episode numbers in their names instead of by
+        # their order in the lists
+        self.matchByNumber = QtWidgets.QCheckBox(
+            "Match files to templates by season/episode number"
+        )
+        self.settingsLayout.addWidget(self.matchByNumber)
+        # Copy the files somewhere else under their new names instead of
+        # renaming them where they are
+        self.copyFrame = QtWidgets.QFrame()
+        self.copyFrame.setSizePolicy(self.compactVertSizePolicy)
+        self.copyLayout = QtWidgets.QHBoxLayout(self.copyFrame)
+        self.copyLayout.setContentsMargins(0, 0, 0, 0)
+        self.copyDestination = QtWidgets.QLineEdit()
+        self.copyDestination.setPlaceholderText("Leave empty to rename in place")
+        self.copyDestination.setClearButtonEnabled(True)
+        copyBrowseBtn = QtWidgets.QToolButton()
+        copyBrowseBtn.setIcon(icon("folder_open.svg"))
+        copyBrowseBtn.setToolTip("Choose a folder to copy the renamed files to")
+        copyBrowseBtn.clicked.connect(self.chooseCopyDestination)
+        self.copyLayout.addWidget(QtWidgets.QLabel("Copy to folder:"))
+        self.copyLayout.addWidget(self.copyDestination)
+        self.copyLayout.addWidget(copyBrowseBtn)
+        self.settingsLayout.addWidget(self.copyFrame)
+        # How new names are built; see namingRules.py for the fields
+        self.ruleFrame = QtWidgets.QFrame()
+        self.ruleFrame.setSizePolicy(self.compactVertSizePolicy)
+        self.ruleLayout = QtWidgets.QHBoxLayout(self.ruleFrame)
+        self.ruleLayout.setContentsMargins(0, 0, 0, 0)
+        self.namingRule = QtWidgets.QLineEdit()
+        self.namingRule.setPlaceholderText(namingRules.DEFAULT_RULE)
+        self.namingRule.setToolTip(RULE_HELP)
+        self.templatePattern = QtWidgets.QLineEdit()
+        self.templatePattern.setPlaceholderText("Regex for {t1}..")
+        self.sourcePattern = QtWidgets.QLineEdit()
+        self.sourcePattern.setPlaceholderText("Regex for {s1}..")
+        self.ruleLayout.addWidget(QtWidgets.QLabel("New name:"))
+        self.ruleLayout.addWidget(self.namingRule, 2)
+        self.ruleLayout.addWidget(QtWidgets.QLabel("Template pattern:"))
+        self.ruleLayout.addWidget(self.templatePattern, 1)
+        self.ruleLayout.addWidget(QtWidgets.QLabel("File pattern:"))
+        self.ruleLayout.addWidget(self.sourcePattern, 1)
+        self.settingsLayout.addWidget(self.ruleFrame)
 
         ###############
         # TOOLBAR BUTTONS, LIST BOXES
@@ -111,13 +147,25 @@ class FileWindow(QtWidgets.QWidget):
         self.rightLayout = QtWidgets.QGridLayout(self.rightBox)
         self.rightList = CustomList()
         self.rightListBtns = self.createListBtns(self.rightList)
+        # New names, next to the files to be renamed
+        self.destModel = DestinationModel(
+            self.leftList.model(), self.rightList.model(), self.currentSuffixes, self
+        )
+        self.destList = DestinationList(self.destModel, self.rightList)
+        self.numOfTargetFiles.valueChanged.connect(self.destModel.suffixCountChanged)
+        self.matchByNumber.toggled.connect(self.destModel.setMatching)
+        for edit in (self.namingRule, self.templatePattern, self.sourcePattern):
+            edit.textChanged.connect(self.ruleChanged)
 
         ###############
         # LIST LAYOUTS
         self.leftLayout.addWidget(self.leftListBtns, 1, 0)
         self.leftLayout.addWidget(self.leftList, 1, 1, 1, 2)
         self.rightLayout.addWidget(self.rightListBtns, 1, 3)
+        self.rightLayout.addWidget(QtWidgets.QLabel("Current name"), 0, 0)
+        self.rightLayout.addWidget(QtWidgets.QLabel("New name"), 0, 2)
         self.rightLayout.addWidget(self.rightList, 1, 0, 1, 2)
+        self.rightLayout.addWidget(self.destList, 1, 2)
         self.listSplitter = QtWidgets.QSplitter()
         self.listSplitter.setChildrenCollapsible(False)
         self.listSplitter.addWidget(self.leftBox)
@@ -126,15 +174,27 @@ class FileWindow(QtWidgets.QWidget):
         ###############
         # BOTTOM BUTTON
         self.execButton = QtWidgets.QPushButton("Preview Rename")
-        self.execButton.setIcon(previewIcon)
+        self.execButton.setIcon(icon("preview.svg"))
         self.execButton.setIconSize(QtCore.QSize(25, 25))
         self.execButton.clicked.connect(self.previewRename)
+        # Save the renames to a file to run later from the command line
+        self.exportButton = QtWidgets.QPushButton("Export Plan...")
+        self.exportButton.setSizePolicy(self.compactSizePolicy)
+        self.exportButton.clicked.connect(self.exportPlan)
+        # Put back the files from the last rename
+        self.undoButton = QtWidgets.QPushButton("Undo Rename...")
+        self.undoButton.setSizePolicy(self.compactSizePolicy)
+        self.undoButton.clicked.connect(self.undoRename)
+        self.bottomLayout = QtWidgets.QHBoxLayout()
+        self.bottomLayout.addWidget(self.execButton)
+        self.bottomLayout.addWidget(self.exportButton)
+        self.bottomLayout.addWidget(self.undoButton)
 
         ###############
         # FINAL SETUP
         self.mainLayout.addLayout(self.settingsLayout)
         self.mainLayout.addWidget(self.listSplitter)
-        self.mainLayout.addWidget(self.execButton)
+        self.mainLayout.addLayout(self.bottomLayout)
 
     ###############
     # TOOLBAR BUTTONS
@@ -188,25 +248,92 @@ class FileWindow(QtWidgets.QWidget):
             l.clear,
         ]
         for btn, icn, tltip, fcn in zip(buttons, icons, tooltips, functions):
-            btn.setIcon(QtGui.QIcon(f"icons/{icn}"))
+            btn.setIcon(icon(icn))
             btn.setIconSize(QtCore.QSize(25, 25))
             btn.setToolTip(tltip)
             btn.clicked.connect(fcn)
             buttonLayout.addWidget(btn)
+        # Clicking sorts, the arrow next to it picks how
+        sortBtn.setMenu(l.sortMenu())
+        sortBtn.setPopupMode(QtWidgets.QToolButton.MenuButtonPopup)
         return buttonFrame
 
+    def currentSuffixes(self):
+        """Text of the suffix boxes in use."""
+        return [s.text() for s in self.suffixBoxes[: self.numOfTargetFiles.value()]]
+
+    def chooseCopyDestination(self):
+        dir = QtWidgets.QFileDialog.getExistingDirectory()
+        if dir:
+            self.copyDestination.setText(dir)
+
+    def currentRule(self):
+        """The NamingRule from the settings, or None for the usual
+        template + suffix + extension. Raises namingRules.RuleError if it
+        isn't valid."""
+        rule = self.namingRule.text()
+        templatePattern = self.templatePattern.text()
+        sourcePattern = self.sourcePattern.text()
+        if not (rule or templatePattern or sourcePattern):
+            return None
+        return namingRules.NamingRule(
+            rule or namingRules.DEFAULT_RULE, templatePattern, sourcePattern
+        )
+
+    def ruleChanged(self):
+        try:
+            rule = self.currentRule()
+            error = None
+        except namingRules.RuleError as e:
+            rule, error = None, str(e)
+        self.destModel.setRule(rule, error is None)
+        self.namingRule.setToolTip(error or RULE_HELP)
+        self.ruleFrame.setStyleSheet("QLineEdit { color: red; }" if error else "")
+
+    def copyDir(self):
+        """The folder to copy files to, or None to rename them in place."""
+        return self.copyDestination.text().strip() or None
+
+    def addSuffixBox(self):
+        # Create a suffix input box and store it in suffixBoxes
+        i = len(self.suffixBoxes)
+        suffixFrame = QtWidgets.QFrame()
+        suffixLayout = QtWidgets.QHBoxLayout(suffixFrame)
+        suffixLayout.setContentsMargins(0, 0, 0, 0)
+        suffix = QtWidgets.QLineEdit()
+        suffix.setValidator(self.filenameValidator)
+        suffix.textChanged.connect(lambda text: self.destModel.suffixChanged(i))
+        suffixLabel = QtWidgets.QLabel(f"File {i+1} Suffix:")
+        suffixLayout.addWidget(suffixLabel)
+        suffixLayout.addWidget(suffix)
+        self.suffixBoxLayout.addWidget(
+            suffixFrame, i // self.boxesPerRow, i % self.boxesPerRow
+        )
+        self.suffixFrames.append(suffixFrame)
+        self.suffixBoxes.append(suffix)
+
     def updateSuffixBoxes(self, n):
-        if self.spinboxPrevValue < n:
-            # Spinbox increased, show next box
-            self.suffixFrames[n - 1].setVisible(True)
-        else:
-            # Spinbox decreased, remove previous box
-            self.suffixFrames[n].setVisible(False)
+        while len(self.suffixBoxes) < n:
+            self.addSuffixBox()
+        # Show the first n boxes; typing a number can skip several at once
+        for i, frame in enumerate(self.suffixFrames):
+            frame.setVisible(i < n)
         self.spinboxPrevValue = n
 
+    def closeEvent(self, event):
+        self.leftList.stopScans()
+        self.rightList.stopScans()
+        super().closeEvent(event)
+
     def previewRename(self):
         raise NotImplementedError()
 
+    def exportPlan(self):
+        raise NotImplementedError()
+
+    def undoRename(self):
+        raise NotImplementedError()
+
 
 if __name__ == "__main__":
     app = QtWidgets.QApplication([])
@@ -0,0 +1,18 @@
+# Icons shared by every window. Each SVG is loaded once per process, and the
+# icons folder is found next to this file, so the program works no matter
+# which directory it's started from.
+
+import os
+from PySide6 import QtGui
+
+ICON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icons")
+
+_cache = {}
+
+
+def icon(name):
+    """The QIcon for icons/<name>."""
+    cached = _cache.get(name)
+    if cached is None:
+        cached = _cache[name] = QtGui.QIcon(os.path.join(ICON_DIR, name))
+    return cached
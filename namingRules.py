@@ -0,0 +1,161 @@
+# Naming rules say how a file's new name is built, for when template name +
+# suffix + extension isn't enough. A rule is written like a Python format
+# string, e.g. "{stem!l}.{s1}{suffix}{ext}" or "Episode {index:03d}{ext}",
+# using these fields:
+#
+#   {stem}       the template file's name without its extension
+#   {suffix}     the suffix for this file
+#   {ext}        the extension of the file being renamed, with its dot
+#   {source}     the current name of the file, without its extension
+#   {index}      the template's number in the list, starting at 1
+#   {fileindex}  the file's number in the list, starting at 1
+#   {t1}, {t2}.. groups captured by the template pattern from {stem}
+#   {s1}, {s2}.. groups captured by the file pattern from {source}
+#
+# Any field can have a format spec ({index:03d}) and a case change: !u for
+# upper case, !l lower, !t title case or !c to capitalize ({stem!u}).
+#
+# A rule is parsed and checked once, and turned into a single Python
+# f-string function, so applying it to each of a few hundred thousand files
+# costs about as much as the plain template + suffix naming.
+
+import re
+import string
+
+DEFAULT_RULE = "{stem}{suffix}{ext}"
+FIELDS = ("stem", "suffix", "ext", "source", "index", "fileindex")
+CONVERSIONS = {"u": "upper", "l": "lower", "t": "title", "c": "capitalize"}
+# Characters that can't be in a filename, the same ones the GUI's suffix
+# boxes don't allow. This includes the path separators, so a rule can't move
+# files to another folder.
+FORBIDDEN_CHARS = '<>:"/\\|?*'
+_CAPTURE_RE = re.compile(r"([ts])([1-9][0-9]*)")
+
+
+class RuleError(ValueError):
+    pass
+
+
+def _checkText(text, what):
+    bad = sorted({c for c in text if c in FORBIDDEN_CHARS})
+    if bad:
+        raise RuleError(
+            f"The naming rule's {what} can't contain {' '.join(bad)}; it only "
+            "gives the new filename, not a folder."
+        )
+
+
+def _compilePattern(pattern, what):
+    if not pattern:
+        return None
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise RuleError(f"The {what} pattern isn't a valid regular expression: {e}")
+
+
+class NamingRule:
+    def __init__(self, rule=DEFAULT_RULE, templatePattern=None, sourcePattern=None):
+        """Compile rule. templatePattern and sourcePattern are optional
+        regular expressions whose groups the rule can use as {t1}.. and
+        {s1}... Raises RuleError if any of them is invalid."""
+        self.rule = rule
+        self.templateRe = _compilePattern(templatePattern, "template")
+        self.sourceRe = _compilePattern(sourcePattern, "file")
+        self.usesTemplate = False
+        self.usesSource = False
+        self.render = self._compile()
+        # The same template is used for each of its files, so remember the
+        # groups from the last one
+        self._lastStem = None
+        self._lastGroups = ()
+        # Catch format specs that don't fit their field, like {stem:03d}
+        try:
+            self("stem", "", ".ext", "source", 1, 1)
+        except (ValueError, TypeError) as e:
+            raise RuleError(f"The naming rule can't be used: {e}")
+
+    def _fieldExpr(self, field):
+        if field in FIELDS:
+            return field
+        m = _CAPTURE_RE.fullmatch(field)
+        if m is None:
+            raise RuleError(f"The naming rule has an unknown field {{{field}}}.")
+        kind, n = m.group(1), int(m.group(2))
+        regex, what = (
+            (self.templateRe, "template") if kind == "t" else (self.sourceRe, "file")
+        )
+        if regex is None:
+            raise RuleError(f"{{{field}}} needs a {what} pattern.")
+        if n > regex.groups:
+            raise RuleError(
+                f"{{{field}}} is used but the {what} pattern only has "
+                f"{regex.groups} group(s)."
+            )
+        if kind == "t":
+            self.usesTemplate = True
+        else:
+            self.usesSource = True
+        return f"{kind}[{n - 1}]"
+
+    def _compile(self):
+        try:
+            parsed = list(string.Formatter().parse(self.rule))
+        except ValueError as e:
+            raise RuleError(f"The naming rule isn't valid: {e}")
+        # Text from the rule is passed in as constants rather than being put
+        # in the generated code
+        consts = {}
+        parts = []
+        for literal, field, spec, conversion in parsed:
+            if literal:
+                _checkText(literal, "text")
+                name = f"_c{len(consts)}"
+                consts[name] = literal
+                parts.append(f"{{{name}}}")
+            if field is None:
+                continue
+            expr = self._fieldExpr(field)
+            if conversion:
+                if conversion not in CONVERSIONS:
+                    raise RuleError(
+                        f"!{conversion} isn't a case change; use !u, !l, !t or !c."
+                    )
+                expr = f"str({expr}).{CONVERSIONS[conversion]}()"
+            if spec:
+                if "{" in spec:
+                    raise RuleError("Fields inside format specs aren't supported.")
+                # The rest of a spec is fixed syntax, but its fill character
+                # ends up in the name, as in {index:/>3}
+                if len(spec) >= 2 and spec[1] in "<>=^":
+                    _checkText(spec[0], "formats")
+                name = f"_c{len(consts)}"
+                consts[name] = spec
+                expr = f"format({expr}, {name})"
+            parts.append(f"{{{expr}}}")
+        code = (
+            "def render(stem, suffix, ext, source, index, fileindex, t, s):\n"
+            f"    return f{''.join(parts)!r}\n"
+        )
+        namespace = dict(consts)
+        exec(compile(code, "<naming rule>", "exec"), namespace)
+        return namespace["render"]
+
+    def _groups(self, regex, text):
+        m = regex.search(text)
+        if m is None:
+            # Names the pattern doesn't match get empty groups
+            return ("",) * regex.groups
+        return m.groups(default="")
+
+    def __call__(self, stem, suffix, ext, source, index, fileIndex):
+        """The new filename for one file."""
+        t = s = ()
+        if self.usesTemplate:
+            if stem != self._lastStem:
+                self._lastStem = stem
+                self._lastGroups = self._groups(self.templateRe, stem)
+            t = self._lastGroups
+        if self.usesSource:
+            s = self._groups(self.sourceRe, source)
+        return self.render(stem, suffix, ext, source, index, fileIndex, t, s)
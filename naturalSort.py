@@ -0,0 +1,73 @@
+# Sorting filenames the way people read them: numbers by their value, so
+# "Episode 2" comes before "Episode 10", and optionally ignoring case and
+# grouping files by folder first. Working out a sort key means splitting the
+# name up, so keys are kept in a SortKeys cache and re-sorting a list only
+# costs the comparisons.
+
+import os
+import re
+from collections import namedtuple
+
+# natural: compare runs of digits as numbers
+# caseFold: ignore upper/lower case
+# byDirectory: sort by folder first, then by name within each folder
+SortOptions = namedtuple(
+    "SortOptions", ["natural", "caseFold", "byDirectory"], defaults=(True, True, False)
+)
+# Forget the cached keys once there are this many of them
+MAX_CACHED_KEYS = 2_000_000
+
+_DIGITS_RE = re.compile(r"[0-9]+")
+
+
+def _encodeNumber(m):
+    # Numbers with more digits are bigger, so putting the number of digits
+    # first makes the text compare the same way the numbers do. The leading
+    # \0 sorts a number before any text at the same place, like an empty
+    # string would.
+    digits = m.group().lstrip("0")
+    return f"\0{chr(0x21 + len(digits))}{digits}"
+
+
+def sortKey(text, options=SortOptions()):
+    """Key to sort text by with the given SortOptions. Strings that only
+    differ in ways the options ignore still sort the same way every time.
+
+    The key is a single string, since those compare several times faster
+    than tuples of text and number parts.
+    """
+    folded = text.casefold() if options.caseFold else text
+    if options.natural:
+        folded = _DIGITS_RE.sub(_encodeNumber, folded)
+    # Break ties with the original text. \0\0 sorts before anything that
+    # can follow in another key, so shorter keys still come first.
+    return f"{folded}\0\0{text}"
+
+
+def pathKey(path, options=SortOptions()):
+    """sortKey for a full path, split into folder and name if
+    options.byDirectory is set."""
+    head, tail = os.path.split(path)
+    if options.byDirectory:
+        return (sortKey(head, options), sortKey(tail, options))
+    return sortKey(tail, options)
+
+
+class SortKeys:
+    """Cache of sort keys for strings, kept from one sort to the next."""
+
+    def __init__(self, maxSize=MAX_CACHED_KEYS):
+        self.maxSize = maxSize
+        self.options = None
+        self.keys = {}
+
+    def get(self, text, options):
+        if options != self.options:
+            self.keys.clear()
+            self.options = options
+        key = self.keys.get(text)
+        if key is None:
+            if len(self.keys) >= self.maxSize:
+                self.keys.clear()
+            key = self.keys[text] = sortKey(text, options)
+        return key
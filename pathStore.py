@@ -0,0 +1,199 @@
+# Compact storage for a long list of file paths. Each row only keeps its
+# filename, an index into a table of interned directory prefixes, and a flag
+# for whether it's a directory, so a million files from a handful of folders
+# cost little more than their filenames. A set of the filenames in each
+# directory keeps the same file from being added twice; it holds the same
+# string objects as the rows, so it costs no more than the sets themselves.
+
+import os
+from array import array
+
+SEPARATORS = os.sep + (os.altsep or "")
+
+
+class PathStore:
+    def __init__(self):
+        # Interned directory prefixes and a lookup from prefix to its index
+        self._dirs = []
+        self._dirIndex = {}
+        # Per-row data, all kept in the same order
+        self._dirIds = array("I")
+        self._names = []
+        self._isDir = bytearray()
+        # {directory index: set of filenames}, for finding duplicates
+        self._index = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, path):
+        head, tail = os.path.split(canonical(path))
+        i = self._dirIndex.get(head)
+        return i is not None and tail in self._index.get(i, ())
+
+    def _internDir(self, d):
+        i = self._dirIndex.get(d)
+        if i is None:
+            i = len(self._dirs)
+            self._dirs.append(d)
+            self._dirIndex[d] = i
+        return i
+
+    def path(self, row):
+        return os.path.join(self._dirs[self._dirIds[row]], self._names[row])
+
+    def paths(self):
+        dirs = self._dirs
+        join = os.path.join
+        return [join(dirs[d], n) for d, n in zip(self._dirIds, self._names)]
+
+    def name(self, row):
+        return self._names[row]
+
+    def dir(self, row):
+        return self._dirs[self._dirIds[row]]
+
+    def namesIn(self, d):
+        """The filenames of the rows directly inside directory d, as a set
+        that mustn't be changed. Doesn't look at the rows themselves."""
+        i = self._dirIndex.get(d)
+        if i is None:
+            return frozenset()
+        return self._index.get(i, frozenset())
+
+    def findRows(self, names):
+        """Return {(directory, filename): row} for the rows named in names, a
+        {directory: filenames} dict, in one pass over the store."""
+        ids = {
+            self._dirIndex[d]: (d, n) for d, n in names.items() if d in self._dirIndex
+        }
+        found = {}
+        for row, (i, name) in enumerate(zip(self._dirIds, self._names)):
+            entry = ids.get(i)
+            if entry is not None and name in entry[1]:
+                found[entry[0], name] = row
+        return found
+
+    def isDir(self, row):
+        return bool(self._isDir[row])
+
+    def isDirs(self):
+        return [bool(d) for d in self._isDir]
+
+    def displayName(self, row):
+        """Filename as it should be shown in a list, with a trailing slash
+        for directories."""
+        if self._isDir[row]:
+            return self._names[row] + "/"
+        return self._names[row]
+
+    def newPaths(self, paths):
+        """Return the paths that aren't in the store yet, without duplicates,
+        in the form extend() expects."""
+        seen = set()
+        new = []
+        for p in paths:
+            p = canonical(p)
+            if p not in seen and p not in self:
+                seen.add(p)
+                new.append(p)
+        return new
+
+    def extend(self, paths, isDirs):
+        """Append paths (as returned by newPaths) to the end of the store.
+        isDirs is an iterable of bools, one per path."""
+        split = os.path.split
+        intern = self._internDir
+        index = self._index
+        for p, d in zip(paths, isDirs):
+            head, tail = split(p)
+            i = intern(head)
+            self._dirIds.append(i)
+            self._names.append(tail)
+            self._isDir.append(1 if d else 0)
+            names = index.get(i)
+            if names is None:
+                names = index[i] = set()
+            names.add(tail)
+
+    def _forget(self, row):
+        # Take a row out of the duplicate index
+        self._index[self._dirIds[row]].discard(self._names[row])
+
+    def rename(self, row, path):
+        """Change the path of a row, e.g. after the file was renamed on
+        disk. path must not be in the store already."""
+        path = canonical(path)
+        self._forget(row)
+        head, tail = os.path.split(path)
+        i = self._internDir(head)
+        self._dirIds[row] = i
+        self._names[row] = tail
+        self._index.setdefault(i, set()).add(tail)
+
+    def take(self, first, last):
+        """Remove rows first through last (inclusive) and return them in a
+        form that can be passed back to insert(). Only for moving rows; they
+        still count as being in the store."""
+        end = last + 1
+        rows = (
+            self._dirIds[first:end],
+            self._names[first:end],
+            self._isDir[first:end],
+        )
+        del self._dirIds[first:end]
+        del self._names[first:end]
+        del self._isDir[first:end]
+        return rows
+
+    def insert(self, row, rows):
+        """Insert rows previously returned by take() before row."""
+        dirIds, names, isDir = rows
+        self._dirIds[row:row] = dirIds
+        self._names[row:row] = names
+        self._isDir[row:row] = isDir
+
+    def remove(self, first, last):
+        for row in range(first, last + 1):
+            self._forget(row)
+        self.take(first, last)
+
+    def removeRanges(self, ranges):
+        """Remove several (first, last) row ranges in one pass."""
+        keep = bytearray(b"\x01") * len(self)
+        for first, last in ranges:
+            for row in range(first, last + 1):
+                self._forget(row)
+            keep[first : last + 1] = bytes(last - first + 1)
+        self.reorder([i for i, k in enumerate(keep) if k])
+
+    def clear(self):
+        self._dirs.clear()
+        self._dirIndex.clear()
+        self._dirIds = array("I")
+        self._names.clear()
+        self._isDir = bytearray()
+        self._index.clear()
+
+    def sortOrder(self, key=None, reverse=False):
+        """Return the row order that would sort the store. key is called with
+        each row number and defaults to the displayed filename."""
+        if key is None:
+            key = self.displayName
+        return sorted(range(len(self)), key=key, reverse=reverse)
+
+    def reorder(self, order):
+        """Rearrange the rows so that new row i is old row order[i]."""
+        self._dirIds = array("I", (self._dirIds[i] for i in order))
+        self._names = [self._names[i] for i in order]
+        self._isDir = bytearray(self._isDir[i] for i in order)
+
+
+def canonical(path):
+    """path without a trailing slash, the way the store keeps it."""
+    if path and path[-1] not in SEPARATORS:
+        return path
+    head, tail = os.path.split(path)
+    if not tail:
+        head, tail = os.path.split(head)
+    return os.path.join(head, tail)
@@ -0,0 +1,335 @@
+# Saving a rename plan to a file and running it later. A plan file lists one
+# operation per line, in the order they have to run: either JSON Lines
+#   {"action": "rename", "source": "/a/x.srt", "dest": "/a/A.en.srt"}
+# or, if the file name ends in .csv, the same three columns with a header
+# row. Files are written and read a line at a time and run in chunks, so
+# plans with millions of files can be applied without holding them in
+# memory, and a plan can be checked or split up before it's run.
+#
+# Applying a plan again after it was interrupted carries on where it
+# stopped. What's been done is recorded in a progress file next to the plan
+# (plan.jsonl.progress), a group of entries at a time like a renameJournal,
+# and then once for each chunk as a whole when it's finished:
+#   {"chunk": [10000, 20000, [10007]]}   entries 10000 to 19999 are done,
+#                                        except for 10007, which failed
+# so reading it back only has to hold on to the single entries of a chunk
+# that was cut short, however much of the plan is done.
+# Entries that aren't recorded are checked against the disk: renames whose
+# source is gone and whose destination exists, and finished copies, are taken
+# as done. An entry whose destination already exists is never run, so
+# applying a plan again can't overwrite anything.
+
+import csv
+import errno
+import json
+import os
+import renameCore
+import renameJournal
+import transfer
+
+FIELDS = ("action", "source", "dest")
+ACTIONS = ("rename", "copy")
+# Operations read and run at a time when applying a plan
+APPLY_CHUNK_SIZE = 10000
+
+
+class PlanError(ValueError):
+    pass
+
+
+def isCsv(path):
+    return path.lower().endswith(".csv")
+
+
+def writePlan(path, operations):
+    """Write (action, source, dest) tuples to path, one per line. Returns
+    how many were written."""
+    n = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if isCsv(path):
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for op in operations:
+                writer.writerow(op)
+                n += 1
+        else:
+            for action, src, dst in operations:
+                line = json.dumps(
+                    {"action": action, "source": src, "dest": dst},
+                    ensure_ascii=False,
+                )
+                f.write(line + "\n")
+                n += 1
+    return n
+
+
+def planOperations(plan=None, sources=None, dests=None):
+    """The operations in a renamePlanner.RenamePlan, or copies of sources to
+    dests if no plan is given."""
+    if plan is not None:
+        return (("rename", s, d) for s, d in zip(plan.sources, plan.dests))
+    return (("copy", s, d) for s, d in zip(sources, dests))
+
+
+def readPlan(path):
+    """Yield the (action, source, dest) tuples in a plan file in order."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if isCsv(path):
+            rows = csv.reader(f)
+            if tuple(next(rows, ())) != FIELDS:
+                raise PlanError(f"{path}: the first row should be {','.join(FIELDS)}")
+            for lineNo, row in enumerate(rows, 2):
+                yield _checked(path, lineNo, row)
+        else:
+            for lineNo, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    row = [record[k] for k in FIELDS]
+                except (ValueError, KeyError, TypeError):
+                    raise PlanError(f"{path}:{lineNo}: not a plan entry")
+                yield _checked(path, lineNo, row)
+
+
+def _checked(path, lineNo, row):
+    if len(row) != 3 or row[0] not in ACTIONS or not row[1] or not row[2]:
+        raise PlanError(f"{path}:{lineNo}: not a plan entry")
+    return tuple(row)
+
+
+def _chunks(operations, size):
+    """Split operations into chunks of about size. A chunk only ends between
+    two operations that don't share a name, so a chain or cycle of renames
+    (A -> temp, B -> A, temp -> B) is never split up: whether its renames
+    went through is worked out from the disk for the whole of it at once."""
+    chunk = []
+    sources = set()
+    dests = set()
+    for op in operations:
+        action, src, dst = op
+        if len(chunk) >= size and src not in dests and dst not in sources:
+            yield chunk
+            chunk = []
+            sources = set()
+            dests = set()
+        chunk.append(op)
+        sources.add(src)
+        dests.add(dst)
+    if chunk:
+        yield chunk
+
+
+def _runs(chunk):
+    """Split a chunk into runs of operations with the same action. Yields
+    (action, position of the run in the chunk, operations)."""
+    start = 0
+    for i in range(1, len(chunk) + 1):
+        if i == len(chunk) or chunk[i][0] != chunk[start][0]:
+            yield chunk[start][0], start, chunk[start:i]
+            start = i
+
+
+def progressPath(path):
+    return path + ".progress"
+
+
+def _progressHeader(path):
+    # Progress recorded for a plan file that has changed since doesn't count
+    st = os.stat(path)
+    return {"plan": os.path.basename(path), "size": st.st_size, "mtime": st.st_mtime_ns}
+
+
+class Progress:
+    """What a progress file says is done: finished chunks as (start, end,
+    failed positions), and the positions recorded one at a time that no
+    finished chunk covers."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = set()
+
+    def __bool__(self):
+        return bool(self.chunks or self.done)
+
+    def addChunk(self, start, end, failed):
+        failed = frozenset(failed)
+        self.chunks.append((start, end, failed))
+        # Only the single entries of unfinished chunks are kept
+        self.done = {k for k in self.done if not start <= k < end or k in failed}
+
+    def doneIn(self, start, end):
+        """The positions from start up to end that are done, as a set."""
+        done = {k for k in self.done if start <= k < end}
+        for first, last, failed in self.chunks:
+            if first < end and last > start:
+                done.update(
+                    k
+                    for k in range(max(first, start), min(last, end))
+                    if k not in failed
+                )
+        return done
+
+
+def readProgress(path):
+    """What's recorded as done in the progress file of the plan at path, as
+    a Progress."""
+    progress = Progress()
+    try:
+        with open(progressPath(path), "rb") as f:
+            if json.loads(f.readline()) != _progressHeader(path):
+                return progress
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn by a crash while it was being written
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                if "chunk" in record:
+                    progress.addChunk(*record["chunk"])
+                else:
+                    progress.done.update(record.get("done", ()))
+    except (OSError, ValueError):
+        pass
+    return progress
+
+
+def _openProgress(path, progress):
+    """A renameJournal.Journal to record finished entries in, starting a new
+    progress file if there's nothing recorded yet."""
+    if not progress:
+        with open(progressPath(path), "wb") as f:
+            f.write(json.dumps(_progressHeader(path)).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+    return renameJournal.Journal(progressPath(path))
+
+
+def _exists(code, src, dst):
+    return (src, dst, OSError(code, os.strerror(code)))
+
+
+def applyPlan(
+    path,
+    chunkSize=APPLY_CHUNK_SIZE,
+    workers=renameCore.DEFAULT_WORKERS,
+    dryRun=False,
+    onFailure=None,
+):
+    """Run the operations in a plan file, a chunk at a time.
+
+    onFailure, if given, is called as onFailure(action, src, dst, exception)
+    for each operation that fails, including ones that weren't run because
+    their destination already exists. Returns (done, skipped, failed)
+    counts, where skipped operations were already done by an earlier run.
+    """
+    done = skipped = failed = 0
+    progress = readProgress(path)
+    journal = None if dryRun else _openProgress(path, progress)
+    position = 0
+    try:
+        for chunk in _chunks(readPlan(path), chunkSize):
+            base = position
+            position += len(chunk)
+            recorded = progress.doneIn(base, position)
+            failedAt = []
+            for action, start, ops in _runs(chunk):
+                finished = _finished(action, ops, base + start, recorded)
+                sources = []
+                dests = []
+                indices = []
+                for k, (_, src, dst) in enumerate(ops, base + start):
+                    if finished[k - base - start]:
+                        skipped += 1
+                        if journal is not None and k not in recorded:
+                            journal.done(k)
+                        continue
+                    sources.append(src)
+                    dests.append(dst)
+                    indices.append(k)
+                if action == "rename":
+                    # Checked in order, so renames that free up names for
+                    # later ones still go through
+                    ok, failures = renameJournal.checkOperations(sources, dests)
+                else:
+                    ok = []
+                    failures = []
+                    for i, (src, dst) in enumerate(zip(sources, dests)):
+                        if os.path.lexists(dst):
+                            failures.append(_exists(errno.EEXIST, src, dst))
+                        else:
+                            ok.append(i)
+                notRun = set(range(len(indices))).difference(ok)
+                failedAt.extend(indices[i] for i in sorted(notRun))
+                sources = [sources[i] for i in ok]
+                dests = [dests[i] for i in ok]
+                indices = [indices[i] for i in ok]
+                runFailures = _apply(
+                    action, sources, dests, indices, journal, workers, dryRun
+                )
+                done += len(sources) - len(runFailures)
+                runFailed = {(src, dst) for src, dst, e in runFailures}
+                failedAt.extend(
+                    k
+                    for k, src, dst in zip(indices, sources, dests)
+                    if (src, dst) in runFailed
+                )
+                failures += runFailures
+                failed += len(failures)
+                if onFailure is not None:
+                    for src, dst, e in failures:
+                        onFailure(action, src, dst, e)
+            if journal is not None:
+                # The chunk's single entries go out first, so a finished
+                # chunk's record comes after all of them
+                journal.flush()
+                journal.mark("chunk", [base, position, sorted(failedAt)])
+    finally:
+        if journal is not None:
+            journal.close(finished=False)
+    return done, skipped, failed
+
+
+def _finished(action, ops, first, recorded):
+    """Which of a run of operations starting at position first in the plan
+    are already done: the recorded ones, finished copies, and renames worked
+    out from the disk the way renameJournal reads an unfinished journal."""
+    flags = bytearray(first + i in recorded for i in range(len(ops)))
+    if action == "rename":
+        sources = [op[1] for op in ops]
+        dests = [op[2] for op in ops]
+        renameJournal.inferDone(sources, dests, flags)
+    else:
+        record = transfer.CopyRecord([op[2] for op in ops])
+        for i, (_, src, dst) in enumerate(ops):
+            if not flags[i] and record.isComplete(src, dst):
+                flags[i] = 1
+    return flags
+
+
+def _apply(action, sources, dests, indices, journal, workers, dryRun):
+    """Run some of a plan's operations, recording the ones that go through
+    in journal. Returns the failures."""
+    if action == "rename":
+        recorder = None
+        if journal is not None:
+            urgent = renameJournal.producedRenames(sources, dests)
+            urgent = {indices[i] for i in urgent}
+            recorder = renameJournal.Recorder(journal, indices, urgent)
+        return renameCore.renameFiles(
+            sources, dests, dryRun=dryRun, workers=workers, journal=recorder
+        )
+    if dryRun:
+        for src, dst in zip(sources, dests):
+            print(f"{src} got copied to {dst}")
+        return []
+    for d in {os.path.dirname(d) for d in dests}:
+        os.makedirs(d or ".", exist_ok=True)
+    failures = transfer.copyFiles(sources, dests, workers=workers)
+    failed = {(src, dst) for src, dst, e in failures}
+    for k, src, dst in zip(indices, sources, dests):
+        if (src, dst) not in failed:
+            journal.done(k)
+    return failures
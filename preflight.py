@@ -0,0 +1,188 @@
+# Checks run on a whole batch before anything is renamed, so a missing file,
+# a folder we can't write to or a name that's too long shows up as a list of
+# problems up front instead of as an os.rename error halfway through the
+# batch. Everything is worked out per directory: each distinct folder is
+# listed once, stat()ed once and checked for access once, and the files are
+# then checked against those results with set and dict lookups.
+
+import itertools
+import os
+from collections import namedtuple
+import tracing
+
+# kind is one of "missing", "missing folder", "bad name", "no access",
+# "other device", "name too long" or "path too long"
+Problem = namedtuple("Problem", ["kind", "source", "dest", "message"])
+
+# Used where os.pathconf can't tell us the limits
+DEFAULT_NAME_MAX = 255
+DEFAULT_PATH_MAX = 260 if os.name == "nt" else 4096
+
+
+class Report:
+    def __init__(self, problems, listings):
+        self.problems = problems
+        # {directory: set of names in it}, for renamePlanner.planRenames so
+        # it doesn't have to list the directories again
+        self.listings = listings
+
+
+class _Dir:
+    """What we know about one directory after listing and stat()ing it.
+    limits is a {device: (name max, path max)} dict shared between
+    directories, since those are the same for a whole filesystem."""
+
+    def __init__(self, path, limits):
+        self.path = path or "."
+        self.names = None
+        self.device = None
+        self.error = None
+        self.writable = False
+        self.nameMax = DEFAULT_NAME_MAX
+        self.pathMax = DEFAULT_PATH_MAX
+        tracing.count("stat calls")
+        try:
+            self.device = os.stat(self.path).st_dev
+            tracing.count("directory listings")
+            with os.scandir(self.path) as it:
+                self.names = {e.name for e in it}
+        except OSError as e:
+            self.error = e.strerror or str(e)
+            return
+        # Renaming in or out of a directory needs write and search access
+        self.writable = os.access(self.path, os.W_OK | os.X_OK)
+        if self.device not in limits:
+            limits[self.device] = (DEFAULT_NAME_MAX, DEFAULT_PATH_MAX)
+            if hasattr(os, "pathconf"):
+                try:
+                    limits[self.device] = (
+                        os.pathconf(self.path, "PC_NAME_MAX"),
+                        os.pathconf(self.path, "PC_PATH_MAX"),
+                    )
+                except (OSError, ValueError):
+                    pass
+        self.nameMax, self.pathMax = limits[self.device]
+
+
+def _length(text):
+    # Limits are in bytes, except on Windows where they're in characters
+    if os.name == "nt":
+        return len(text)
+    return len(os.fsencode(text))
+
+
+def _tooLong(text, limit):
+    # A character is at most 4 bytes, so most names don't need encoding
+    return len(text) * 4 > limit and _length(text) > limit
+
+
+def _check(src, dst, srcDir, srcName, dstDir, dstName, copying):
+    """The Problem with one operation, or None."""
+    verb = "copy" if copying else "rename"
+    if srcDir.names is None:
+        return Problem(
+            "missing folder",
+            src,
+            dst,
+            f"Can't read the folder {srcDir.path} that {src} is in: {srcDir.error}.",
+        )
+    if srcName not in srcDir.names:
+        return Problem("missing", src, dst, f"{src} doesn't exist anymore.")
+    if src == dst:
+        return None
+    # A naming rule can leave nothing but a folder, like "{suffix}" for files
+    # without one
+    if dstName in ("", ".", ".."):
+        return Problem(
+            "bad name",
+            src,
+            dst,
+            f"The new name for {src} would be {dstName!r}, which isn't a filename.",
+        )
+    if not copying and not srcDir.writable:
+        return Problem(
+            "no access",
+            src,
+            dst,
+            f"Can't rename {src} because {srcDir.path} can't be written to.",
+        )
+    # Copies create their destination folder if it isn't there yet
+    if dstDir.names is None and not copying:
+        return Problem(
+            "missing folder",
+            src,
+            dst,
+            f"Can't rename {src} to {dst}: {dstDir.path}: {dstDir.error}.",
+        )
+    if dstDir.names is not None and not dstDir.writable:
+        return Problem(
+            "no access",
+            src,
+            dst,
+            f"Can't {verb} {src} to {dst} because {dstDir.path} can't be "
+            "written to.",
+        )
+    if not copying and dstDir.device != srcDir.device:
+        return Problem(
+            "other device",
+            src,
+            dst,
+            f"Can't rename {src} to {dst} because they're on different drives.",
+        )
+    if _tooLong(dstName, dstDir.nameMax):
+        return Problem(
+            "name too long",
+            src,
+            dst,
+            f"The new name for {src} is longer than the limit of "
+            f"{dstDir.nameMax}: {dstName}",
+        )
+    if _tooLong(dst, dstDir.pathMax):
+        return Problem(
+            "path too long",
+            src,
+            dst,
+            f"The new path for {src} is longer than the limit of "
+            f"{dstDir.pathMax}: {dst}",
+        )
+    return None
+
+
+def checkPlan(sources, dests, copying=False):
+    """Check that each source can be renamed (or copied, if copying is set)
+    to its dest. Returns a Report listing every problem found, in plan
+    order; if report.problems is empty the batch should go through."""
+    with tracing.span("preflight", files=len(sources)):
+        # Splitting each path once is most of the work for big batches
+        srcSplits = [os.path.split(p) for p in sources]
+        dstSplits = [os.path.split(p) for p in dests]
+        dirs = {}
+        limits = {}
+        for head, tail in itertools.chain(srcSplits, dstSplits):
+            if head not in dirs:
+                dirs[head] = _Dir(head, limits)
+        problems = []
+        for src, dst, (srcHead, srcName), (dstHead, dstName) in zip(
+            sources, dests, srcSplits, dstSplits
+        ):
+            problem = _check(
+                src, dst, dirs[srcHead], srcName, dirs[dstHead], dstName, copying
+            )
+            if problem is not None:
+                problems.append(problem)
+        listings = {
+            path: d.names if d.names is not None else set() for path, d in dirs.items()
+        }
+        return Report(problems, listings)
+
+
+def problemSummary(problems, total, limit=10, action="renamed"):
+    """Describe a list of Problems in a few lines, like
+    renameCore.failureSummary."""
+    lines = [
+        f"{len(problems)} of {total} files can't be {action}:",
+        *(p.message for p in problems[:limit]),
+    ]
+    if len(problems) > limit:
+        lines.append(f"...and {len(problems) - limit} more.")
+    return "\n".join(lines)
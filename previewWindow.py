@@ -5,52 +5,104 @@
 # resize the window easily, can't add my own widgets to it easily)
 
 # https://doc.qt.io/qtforpython/PySide6/QtWidgets/QDialog.html
-# https://doc.qt.io/qtforpython/PySide6/QtWidgets/QTableWidget.html
+# https://doc.qt.io/qtforpython/PySide6/QtWidgets/QTableView.html
+# https://doc.qt.io/qtforpython/PySide6/QtCore/QAbstractTableModel.html
 
+import os
 import sys
 from PySide6 import QtCore, QtWidgets, QtGui
+import tracing
+from icons import icon
+
+# Number of rows looked at when guessing how wide the columns should be
+WIDTH_SAMPLE_SIZE = 200
+
+
+class PreviewModel(QtCore.QAbstractTableModel):
+    """Two read-only columns of filenames. left and right are lists of paths
+    and only the rows the view asks for get turned into filenames."""
+
+    headers = ("Original Filename", "New Filename")
+
+    def __init__(self, left, right, parent=None):
+        super().__init__(parent)
+        self.columns = (left, right)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns[0])
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return 2
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return os.path.basename(self.columns[index.column()][index.row()])
+        if role == QtCore.Qt.ToolTipRole:
+            return self.columns[index.column()][index.row()]
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self.headers[section]
+        return section + 1
+
+    def flags(self, index):
+        # Read only
+        return QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled
+
+    def sampleRows(self, n=WIDTH_SAMPLE_SIZE):
+        """Up to n row numbers spread evenly over the whole table."""
+        rows = self.rowCount()
+        if rows <= n:
+            return range(rows)
+        # Round the step up so there are never more than n
+        return range(0, rows, -(-rows // n))
 
 
 class PreviewDialog(QtWidgets.QDialog):
     def __init__(self, left, right):
+        """left and right are the paths before and after renaming."""
         super().__init__()
-        okIcon = QtGui.QIcon("icons/check_circle.svg")
-        cancelIcon = QtGui.QIcon("icons/cancel.svg")
         maxs = QtWidgets.QSizePolicy.Maximum
         self.compactSizePolicy = QtWidgets.QSizePolicy(maxs, maxs)
         self.setWindowFlag(QtCore.Qt.WindowMaximizeButtonHint, True)
         self.setWindowFlag(QtCore.Qt.WindowMinimizeButtonHint, True)
 
         self.mainLayout = QtWidgets.QVBoxLayout(self)
-        self.mainTable = QtWidgets.QTableWidget(len(left), 2)
+        self.model = PreviewModel(left, right, self)
+        self.mainTable = QtWidgets.QTableView()
+        self.mainTable.setModel(self.model)
         self.mainTable.setSizeAdjustPolicy(
             QtWidgets.QAbstractScrollArea.AdjustToContents
         )
-        # Set header names and sizes
-        leftHeader = QtWidgets.QTableWidgetItem("Original Filename")
-        rightHeader = QtWidgets.QTableWidgetItem("New Filename")
-        self.mainTable.setHorizontalHeaderItem(0, leftHeader)
-        self.mainTable.setHorizontalHeaderItem(1, rightHeader)
+        # Every row has the same height so the view never has to measure them
+        fm = self.mainTable.fontMetrics()
+        vHeader = self.mainTable.verticalHeader()
+        vHeader.setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        vHeader.setDefaultSectionSize(fm.height() + 6)
+        # Size the columns from a sample of the rows instead of all of them
         header = self.mainTable.horizontalHeader()
-        header.setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
-        header.setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents)
-        # Create two columns of table items containing the items in the left
-        # and right lists
-        for i, (l, r) in enumerate(zip(left, right)):
-            li = QtWidgets.QTableWidgetItem(l)
-            ri = QtWidgets.QTableWidgetItem(r)
-            self.mainTable.setItem(i, 0, li)
-            self.mainTable.setItem(i, 1, ri)
-        # Set the table items to be read only
-        self.mainTable.setEditTriggers(QtWidgets.QTableWidget.NoEditTriggers)
+        header.setSectionResizeMode(QtWidgets.QHeaderView.Interactive)
+        with tracing.span("preview layout", rows=self.model.rowCount()):
+            for col in range(2):
+                header.resizeSection(col, self.estimateColumnWidth(col))
+        self.mainTable.setEditTriggers(QtWidgets.QTableView.NoEditTriggers)
 
         # Create the "ok" and "cancel" buttons
         self.ok = QtWidgets.QPushButton("Rename!")
-        self.ok.setIcon(okIcon)
+        self.ok.setIcon(icon("check_circle.svg"))
         self.ok.setIconSize(QtCore.QSize(20, 20))
         self.ok.setAutoDefault(False)
         self.cancel = QtWidgets.QPushButton("Cancel")
-        self.cancel.setIcon(cancelIcon)
+        self.cancel.setIcon(icon("cancel.svg"))
         self.cancel.setIconSize(QtCore.QSize(20, 20))
         self.cancel.setDefault(True)
         self.btns = QtWidgets.QDialogButtonBox()
@@ -62,6 +114,14 @@ class PreviewDialog(QtWidgets.QDialog):
         self.mainLayout.addWidget(self.mainTable)
         self.mainLayout.addWidget(self.btns)
 
+    def estimateColumnWidth(self, col):
+        fm = self.mainTable.fontMetrics()
+        names = [self.model.headers[col]]
+        for row in self.model.sampleRows():
+            names.append(self.model.data(self.model.index(row, col)))
+        # Leave room for the cell padding
+        return max(fm.horizontalAdvance(n) for n in names) + 20
+
     def accept(self):
         # Show warning box and then do default behavior
         ret = QtWidgets.QMessageBox.warning(
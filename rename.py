@@ -4,11 +4,120 @@
 
 import os
 import sys
+import time
 from PySide6 import QtCore, QtGui, QtWidgets
 from fileWindow import FileWindow
-from previewWindow import PreviewDialog
+import renameCore
+import renameJournal
+import namingRules
+import planFile
+import preflight
+import renamePlanner
+import tokenMatcher
+import transfer
 
 DEBUG_MODE = False
+# Set to make the program print the time (time.time()) once its window is up
+# and then quit; used by benchmarks/bench.py --startup
+STARTUP_ENV_VAR = "RENAME_STARTUP_CHECK"
+
+
+class RenameWorker(QtCore.QThread):
+    """Runs the renames in a RenamePlan off the UI thread."""
+
+    # (number of files renamed so far, total)
+    progress = QtCore.Signal(int, int)
+
+    def __init__(self, plan, parent=None):
+        super().__init__(parent)
+        self.plan = plan
+        self.failures = []
+        # Set if the journal couldn't be written
+        self.error = None
+        # Only update the progress bar about once per percent
+        self.step = max(1, len(plan) // 100)
+
+    def reportProgress(self, done, total):
+        if done % self.step == 0 or done == total:
+            self.progress.emit(done, total)
+
+    def run(self):
+        if DEBUG_MODE:
+            self.failures = renameCore.renameFiles(
+                self.plan.sources,
+                self.plan.dests,
+                dryRun=True,
+                progress=self.reportProgress,
+            )
+            return
+        try:
+            self.failures = renameJournal.runRenames(
+                self.plan.sources, self.plan.dests, progress=self.reportProgress
+            )
+        except OSError as e:
+            self.error = e
+
+
+class JournalWorker(QtCore.QThread):
+    """Finishes or undoes an earlier batch of renames from its journal off
+    the UI thread."""
+
+    # Progress in thousandths
+    progress = QtCore.Signal(int)
+
+    def __init__(self, path, undo, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.undo = undo
+        self.plan = None
+        self.failures = []
+        self.error = None
+        self.lastReported = -1
+
+    def reportProgress(self, done, total):
+        permille = done * 1000 // total if total else 1000
+        if permille != self.lastReported:
+            self.lastReported = permille
+            self.progress.emit(permille)
+
+    def run(self):
+        try:
+            if self.undo:
+                self.plan, self.failures = renameJournal.undo(
+                    self.path, progress=self.reportProgress
+                )
+            else:
+                state, self.failures = renameJournal.resume(
+                    self.path, progress=self.reportProgress
+                )
+                self.plan = renamePlanner.RenamePlan(state.sources, state.dests, [])
+        except (OSError, renameJournal.JournalError) as e:
+            self.error = e
+
+
+class CopyWorker(QtCore.QThread):
+    """Copies files to their new names off the UI thread."""
+
+    # Thousandths of the bytes copied so far
+    progress = QtCore.Signal(int)
+
+    def __init__(self, sources, dests, parent=None):
+        super().__init__(parent)
+        self.sources = sources
+        self.dests = dests
+        self.failures = []
+        self.lastReported = -1
+
+    def reportProgress(self, done, total):
+        permille = done * 1000 // total if total else 1000
+        if permille != self.lastReported:
+            self.lastReported = permille
+            self.progress.emit(permille)
+
+    def run(self):
+        self.failures = transfer.copyFiles(
+            self.sources, self.dests, progress=self.reportProgress
+        )
 
 
 class MainWindow(FileWindow):
@@ -16,106 +125,304 @@ class MainWindow(FileWindow):
         super().__init__()
 
     def getLists(self):
-        """Extract filenames, source paths, and suffixes from the UI."""
-        basenames = []
-        sources = []
-        suffixes = []
+        """Extract template basenames, source paths, and suffixes from the UI."""
         # Left list contains template filenames
-        for i in range(self.leftList.count()):
-            item = self.leftList.item(i)
-            name = item.text()
-            # Remove extension
-            basename = os.path.splitext(name)[0]
-            basenames.append(basename)
+        basenames = renameCore.templateBasenames(self.leftList.paths())
         # Right list contains target files
-        for i in range(self.rightList.count()):
-            item = self.rightList.item(i)
-            itemPath = item.toolTip()
-            sources.append(itemPath)
-        for suffixBox in self.suffixBoxes:
-            if suffixBox.isVisible():
-                suffixes.append(suffixBox.text())
+        sources = self.rightList.paths()
+        suffixes = self.currentSuffixes()
         return basenames, sources, suffixes
 
     def checkInputs(self, basenames, sources, suffixes):
-        if len(sources) == 0:
-            # No input
-            self.showError("There is nothing to rename.")
-            return False
-        elif len(sources) != len(basenames) * len(suffixes):
-            # Bad input
-            self.showError(
-                "The number of files on the left must be the same as the number of "
-                "files on the right times the number of files to rename per template "
-                "file (specified at the top left)."
-            )
+        error, warning = renameCore.checkInputs(basenames, sources, suffixes)
+        if error:
+            self.showError(error)
             return False
-        elif not all(suffixes):
-            # There is at least one empty suffix
-            ret = self.showWarning(
-                "At least one suffix is empty. Be careful that your files don't "
-                "overwrite each other!"
-            )
+        if warning:
+            ret = self.showWarning(warning)
             if ret == QtWidgets.QMessageBox.Cancel:
                 return False
-        elif len(suffixes) != len(set(suffixes)):
-            # There are duplicate suffixes
+        return True
+
+    def getDests(self, basenames, sources, suffixes, rule=None):
+        return renameCore.getDests(basenames, sources, suffixes, self.copyDir(), rule)
+
+    def matchLists(self, basenames, sources, suffixes):
+        """Reorder basenames and sources by matching episode numbers.
+        Returns (None, None) if the user cancels."""
+        templates = self.leftList.paths()
+        result = tokenMatcher.matchFiles(templates, sources, len(suffixes))
+        if not result.ok():
             ret = self.showWarning(
-                "At least two of the suffixes are the same. Be careful that your files "
-                "don't overwrite each other!"
+                "Some files couldn't be matched to a template and won't be "
+                "renamed:\n" + tokenMatcher.matchSummary(result, templates, sources)
             )
             if ret == QtWidgets.QMessageBox.Cancel:
-                return False
-        return True
+                return None, None
+        return tokenMatcher.matchedLists(result, basenames, sources)
 
-    def getDests(self, basenames, sources, suffixes):
-        dests = []
-        n = len(suffixes)  # Num of renames per basename
-        for base_num in range(len(basenames)):
-            b = basenames[base_num]
-            for i in range(n):
-                suf = suffixes[i]
-                src = sources[base_num * n + i]
-                srcDir = os.path.dirname(src)
-                ext = os.path.splitext(src)[1]
-                newName = f"{b}{suf}{ext}"
-                dest = os.path.join(srcDir, newName)
-                dests.append(dest)
-        return dests
-
-    def previewRename(self):
+    def makePlan(self):
+        """Check the lists and work out what to do with them. Returns
+        (sources, dests, plan), where plan is None when copying, or None if
+        there's a problem that's already been shown to the user."""
+        try:
+            rule = self.currentRule()
+        except namingRules.RuleError as e:
+            self.showError(str(e))
+            return None
         basenames, sources, suffixes = self.getLists()
+        if self.matchByNumber.isChecked():
+            basenames, sources = self.matchLists(basenames, sources, suffixes)
+            if basenames is None:
+                return None
         if not self.checkInputs(basenames, sources, suffixes):
+            return None
+        dests = self.getDests(basenames, sources, suffixes, rule)
+        copying = self.copyDir() is not None
+        # Catch files that can't be changed before any of them are
+        report = preflight.checkPlan(sources, dests, copying)
+        if report.problems:
+            action = "copied" if copying else "renamed"
+            self.showError(
+                preflight.problemSummary(report.problems, len(sources), action=action)
+            )
+            return None
+        if copying:
+            plan = None
+            conflicts = transfer.findCopyConflicts(sources, dests)
+        else:
+            plan = renamePlanner.planRenames(sources, dests, report.listings)
+            conflicts = plan.conflicts
+        if conflicts:
+            action = "copied" if copying else "renamed"
+            self.showError(self.conflictSummary(conflicts, action=action))
+            return None
+        return sources, dests, plan
+
+    def previewRename(self):
+        planned = self.makePlan()
+        if planned is None:
             return
-        dests = self.getDests(basenames, sources, suffixes)
-        # Only display the basenames in the preview, not the full path
-        srcNames = [os.path.basename(s) for s in sources]
-        dstNames = [os.path.basename(d) for d in dests]
-        # Create and display the preview dialog box
-        self.msgBox = PreviewDialog(srcNames, dstNames)
+        sources, dests, plan = planned
+        copying = plan is None
+        # Create and display the preview dialog box. It isn't imported until
+        # it's needed so the main window comes up sooner.
+        from previewWindow import PreviewDialog
+
+        self.msgBox = PreviewDialog(sources, dests)
         self.msgBox.setWindowTitle(self.windowTitle())
         result = self.msgBox.exec()
         if result == QtWidgets.QDialog.Accepted:
-            self.rename(sources, dests)
-
-    def rename(self, sources, dests):
-        for src, dst in zip(sources, dests):
-            if DEBUG_MODE:
-                print(f"{src} got moved to {dst}")
+            if copying:
+                self.copy(sources, dests)
             else:
-                try:
-                    os.rename(src, dst)
-                except FileNotFoundError:
-                    self.showError(
-                        "Something went wrong! One of the files you're trying to "
-                        "rename seems not to exist."
-                    )
-        # Change the items in the right list to reflect the new filenames
-        self.rightList.clear()
-        self.rightList.addFilenames(dests)
+                self.rename(sources, dests, plan)
+
+    def exportPlan(self):
+        """Save what would be done to a file that can be run later with
+        renameCli.py --apply-plan."""
+        planned = self.makePlan()
+        if planned is None:
+            return
+        sources, dests, plan = planned
+        path = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Export Plan", "plan.jsonl", "Plan files (*.jsonl *.csv)"
+        )[0]
+        if not path:
+            return
+        if plan is None:
+            ops = planFile.planOperations(sources=sources, dests=dests)
+        else:
+            ops = planFile.planOperations(plan)
+        try:
+            n = planFile.writePlan(path, ops)
+        except OSError as e:
+            self.showError(f"Couldn't write {path}: {e.strerror}")
+            return
         QtWidgets.QMessageBox.information(
-            self, self.windowTitle(), "Files renamed!", QtWidgets.QMessageBox.Ok
+            self,
+            self.windowTitle(),
+            f"Saved {n} entries to {path}.",
+            QtWidgets.QMessageBox.Ok,
+        )
+
+    def conflictSummary(self, conflicts, limit=10, action="renamed"):
+        lines = [
+            f"These files can't be {action} without overwriting other files:",
+            *(c.message for c in conflicts[:limit]),
+        ]
+        if len(conflicts) > limit:
+            lines.append(f"...and {len(conflicts) - limit} more.")
+        return "\n".join(lines)
+
+    def rename(self, sources, dests, plan=None):
+        if plan is None:
+            plan = renamePlanner.planRenames(sources, dests)
+        self.renameSources = sources
+        # Our own renames aren't outside changes; the lists are updated
+        # when the worker is done
+        for lst in (self.leftList, self.rightList):
+            lst.watcher.pause()
+        self.renameWorker = RenameWorker(plan, self)
+        self.renameProgress = QtWidgets.QProgressDialog(
+            "Renaming files...", None, 0, len(plan), self
+        )
+        self.renameProgress.setWindowTitle(self.windowTitle())
+        self.renameProgress.setWindowModality(QtCore.Qt.WindowModal)
+        self.renameProgress.setMinimumDuration(500)
+        self.renameProgress.setValue(0)
+        self.renameWorker.progress.connect(self.renameProgress.setValue)
+        self.renameWorker.finished.connect(self.renameFinished)
+        self.renameWorker.start()
+
+    def renameFinished(self):
+        worker = self.renameWorker
+        self.renameProgress.hide()
+        self.renameProgress.deleteLater()
+        worker.deleteLater()
+        self.renameProgress = self.renameWorker = None
+        if worker.error is not None:
+            for lst in (self.leftList, self.rightList):
+                lst.watcher.resume()
+            self.showError(
+                "The renames couldn't be recorded, so they were stopped: "
+                f"{worker.error.strerror or worker.error}"
+            )
+            # Anything renamed before it stopped can be finished or undone
+            self.checkInterrupted()
+            return
+        # Change the items in the right list to reflect the new filenames.
+        # Files that couldn't be renamed keep their old name.
+        newPaths = renamePlanner.finalPaths(
+            worker.plan, self.renameSources, worker.failures
+        )
+        self.rightList.replacePaths(dict(zip(self.renameSources, newPaths)))
+        for lst in (self.leftList, self.rightList):
+            lst.watcher.resume()
+        if worker.failures:
+            self.showError(renameCore.failureSummary(worker.failures, len(worker.plan)))
+        else:
+            QtWidgets.QMessageBox.information(
+                self, self.windowTitle(), "Files renamed!", QtWidgets.QMessageBox.Ok
+            )
+
+    def undoRename(self):
+        path = renameJournal.latest()
+        if path is None:
+            self.showError("There's no rename to undo.")
+            return
+        try:
+            count = renameJournal.status(path)[0]["count"]
+        except (OSError, renameJournal.JournalError) as e:
+            self.showError(str(e))
+            return
+        ret = self.showWarning(
+            f"Undo the last rename of {count} files? Files that were changed "
+            "since then are left as they are."
+        )
+        if ret == QtWidgets.QMessageBox.Cancel:
+            return
+        self.runJournal(path, undo=True)
+
+    def checkInterrupted(self):
+        """Offer to finish or undo a batch of renames that was interrupted."""
+        path = renameJournal.interrupted()
+        if path is None:
+            return
+        box = QtWidgets.QMessageBox(
+            QtWidgets.QMessageBox.Warning,
+            self.windowTitle(),
+            "The last rename was stopped before it finished. Finish it, or "
+            "put the files back the way they were?",
+            parent=self,
         )
+        finish = box.addButton("Finish", QtWidgets.QMessageBox.AcceptRole)
+        undo = box.addButton("Undo", QtWidgets.QMessageBox.DestructiveRole)
+        box.addButton("Not Now", QtWidgets.QMessageBox.RejectRole)
+        box.exec()
+        if box.clickedButton() is finish:
+            self.runJournal(path, undo=False)
+        elif box.clickedButton() is undo:
+            self.runJournal(path, undo=True)
+
+    def runJournal(self, path, undo):
+        """Undo (or finish, if undo isn't set) the batch in a journal."""
+        for lst in (self.leftList, self.rightList):
+            lst.watcher.pause()
+        self.journalWorker = JournalWorker(path, undo, self)
+        text = "Putting files back..." if undo else "Renaming files..."
+        self.journalProgress = QtWidgets.QProgressDialog(text, None, 0, 1000, self)
+        self.journalProgress.setWindowTitle(self.windowTitle())
+        self.journalProgress.setWindowModality(QtCore.Qt.WindowModal)
+        self.journalProgress.setMinimumDuration(500)
+        self.journalProgress.setValue(0)
+        self.journalWorker.progress.connect(self.journalProgress.setValue)
+        self.journalWorker.finished.connect(self.journalFinished)
+        self.journalWorker.start()
+
+    def journalFinished(self):
+        worker = self.journalWorker
+        self.journalProgress.hide()
+        self.journalProgress.deleteLater()
+        worker.deleteLater()
+        self.journalProgress = self.journalWorker = None
+        if worker.plan is not None:
+            paths = self.rightList.paths()
+            newPaths = renamePlanner.finalPaths(worker.plan, paths, worker.failures)
+            self.rightList.replacePaths(dict(zip(paths, newPaths)))
+        for lst in (self.leftList, self.rightList):
+            lst.watcher.resume()
+        if worker.error is not None:
+            self.showError(str(worker.error))
+        elif worker.failures:
+            action = "put back" if worker.undo else "renamed"
+            self.showError(
+                renameCore.failureSummary(
+                    worker.failures, len(worker.plan), action=action
+                )
+            )
+        else:
+            text = "Files put back!" if worker.undo else "Files renamed!"
+            QtWidgets.QMessageBox.information(
+                self, self.windowTitle(), text, QtWidgets.QMessageBox.Ok
+            )
+
+    def copy(self, sources, dests):
+        """Copy sources to dests, leaving the lists as they are. Copies that
+        were already finished by an earlier, interrupted run are skipped."""
+        try:
+            os.makedirs(self.copyDir(), exist_ok=True)
+        except OSError as e:
+            self.showError(f"Couldn't create {self.copyDir()}: {e.strerror}")
+            return
+        self.copyWorker = CopyWorker(sources, dests, self)
+        self.copyProgress = QtWidgets.QProgressDialog(
+            "Copying files...", None, 0, 1000, self
+        )
+        self.copyProgress.setWindowTitle(self.windowTitle())
+        self.copyProgress.setWindowModality(QtCore.Qt.WindowModal)
+        self.copyProgress.setMinimumDuration(500)
+        self.copyProgress.setValue(0)
+        self.copyWorker.progress.connect(self.copyProgress.setValue)
+        self.copyWorker.finished.connect(self.copyFinished)
+        self.copyWorker.start()
+
+    def copyFinished(self):
+        worker = self.copyWorker
+        self.copyProgress.hide()
+        self.copyProgress.deleteLater()
+        worker.deleteLater()
+        self.copyProgress = self.copyWorker = None
+        if worker.failures:
+            self.showError(
+                renameCore.failureSummary(
+                    worker.failures, len(worker.sources), action="copied"
+                )
+            )
+        else:
+            QtWidgets.QMessageBox.information(
+                self, self.windowTitle(), "Files copied!", QtWidgets.QMessageBox.Ok
+            )
 
     def showError(self, text):
         QtWidgets.QMessageBox.critical(
@@ -138,5 +445,10 @@ if __name__ == "__main__":
 
     win = MainWindow()
     win.show()
+    if os.environ.get(STARTUP_ENV_VAR):
+        # Runs once the window has been shown and painted
+        QtCore.QTimer.singleShot(0, lambda: (print(time.time()), app.quit()))
+    else:
+        QtCore.QTimer.singleShot(0, win.checkInterrupted)
 
     sys.exit(app.exec())
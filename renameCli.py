@@ -0,0 +1,367 @@
+# Command line front end for renameCore. Doesn't load Qt, so it starts fast and
+# can be run from scripts and cron jobs.
+#
+# Example:
+#   python renameCli.py -t videos/ -r subs/ audio/ -s .en -s .jpn --dry-run
+#
+# Each template/target argument can be a file, a directory (its files are
+# used in sorted order), or @listfile, a text file with one path per line.
+
+import argparse
+import os
+import sys
+import namingRules
+import naturalSort
+import renameCore
+import renameJournal
+import scanCache
+from dirScanner import scanTree
+import planFile
+import preflight
+import renamePlanner
+import tokenMatcher
+import transfer
+import tracing
+
+
+def expandPaths(args, recursive=False, cache=None, natural=False):
+    """Turn a list of file, directory and @listfile arguments into a flat
+    list of file paths. cache is an optional scanCache.ScanCache used when
+    scanning directories recursively. Files from a directory are sorted by
+    name, with numbers in order of value if natural is set."""
+    paths = []
+    with tracing.span("scan", args=len(args)):
+        for arg in args:
+            if arg.startswith("@"):
+                with open(arg[1:], encoding="utf-8") as f:
+                    paths.extend(line.rstrip("\n") for line in f if line.strip())
+            elif os.path.isdir(arg):
+                if recursive:
+                    # Already in sorted order
+                    found = [
+                        p for batch, dirs in scanTree(arg, cache=cache) for p in batch
+                    ]
+                else:
+                    found = [e.path for e in os.scandir(arg) if e.is_file()]
+                    found.sort()
+                if natural:
+                    options = naturalSort.SortOptions(byDirectory=True)
+                    found.sort(key=lambda p: naturalSort.pathKey(p, options))
+                paths.extend(found)
+            else:
+                paths.append(arg)
+    return paths
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Rename files in bulk based on other filenames."
+    )
+    parser.add_argument(
+        "-t",
+        "--templates",
+        nargs="+",
+        help="template files, directories or @listfiles",
+    )
+    parser.add_argument(
+        "-r",
+        "--targets",
+        nargs="+",
+        help="files to rename, directories or @listfiles",
+    )
+    parser.add_argument(
+        "-s",
+        "--suffix",
+        action="append",
+        dest="suffixes",
+        help="suffix for each file per template file (repeat once per file)",
+    )
+    parser.add_argument(
+        "--rule",
+        help="how to build each new name, e.g. '{stem} - {index:02d}{suffix}{ext}' "
+        f"(default: '{namingRules.DEFAULT_RULE}'); see namingRules.py for the fields",
+    )
+    parser.add_argument(
+        "--template-pattern",
+        metavar="REGEX",
+        help="regular expression whose groups the rule can use as {t1}, {t2}.. "
+        "from each template name",
+    )
+    parser.add_argument(
+        "--source-pattern",
+        metavar="REGEX",
+        help="regular expression whose groups the rule can use as {s1}, {s2}.. "
+        "from each current file name",
+    )
+    parser.add_argument(
+        "-R",
+        "--recursive",
+        action="store_true",
+        help="add files from directories recursively",
+    )
+    parser.add_argument(
+        "-N",
+        "--natural-sort",
+        action="store_true",
+        help="sort files from directories with numbers in order of value "
+        "(Episode 2 before Episode 10) and ignoring case",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="read every directory again instead of using the scan cache",
+    )
+    parser.add_argument(
+        "-m",
+        "--match",
+        action="store_true",
+        help="pair files with templates by season/episode number instead of order",
+    )
+    parser.add_argument(
+        "-c",
+        "--copy-to",
+        metavar="DIR",
+        help="copy the files into DIR with their new names instead of renaming "
+        "them; running the same copy again resumes it",
+    )
+    parser.add_argument(
+        "--export-plan",
+        metavar="FILE",
+        help="write the renames (or copies) to FILE instead of running them; "
+        "JSON Lines, or CSV if FILE ends in .csv",
+    )
+    parser.add_argument(
+        "--apply-plan",
+        metavar="FILE",
+        help="run the renames in a file written by --export-plan; running it "
+        "again after an interruption carries on where it stopped",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=planFile.APPLY_CHUNK_SIZE,
+        help="entries of a plan file to read and run at a time (default: "
+        "%(default)s)",
+    )
+    parser.add_argument(
+        "--undo",
+        nargs="?",
+        const="",
+        metavar="JOURNAL",
+        help="put back the files from the last rename, or from the rename "
+        "recorded in JOURNAL",
+    )
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const="",
+        metavar="JOURNAL",
+        help="finish a rename that was interrupted (the last one, or the one "
+        "recorded in JOURNAL)",
+    )
+    parser.add_argument(
+        "--no-journal",
+        action="store_true",
+        help="don't keep a journal of the renames; they can't be resumed or undone",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="only print what would be renamed",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="rename even if the suffixes look like they'll cause overwrites",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=renameCore.DEFAULT_WORKERS,
+        help="number of renames to run at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help=f"write a Chrome trace of each stage to FILE (or set {tracing.ENV_VAR})",
+    )
+    args = parser.parse_args(argv)
+    standalone = args.apply_plan or args.undo is not None or args.resume is not None
+    if not standalone and not (args.templates and args.targets):
+        parser.error(
+            "--templates and --targets are required unless using --apply-plan, "
+            "--undo or --resume"
+        )
+    return args
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if args.trace:
+        tracing.enable(args.trace)
+    if args.apply_plan:
+        return applyPlan(args)
+    if args.undo is not None or args.resume is not None:
+        return runJournal(args)
+    suffixes = args.suffixes if args.suffixes else [""]
+    rule = None
+    if args.rule or args.template_pattern or args.source_pattern:
+        try:
+            rule = namingRules.NamingRule(
+                args.rule or namingRules.DEFAULT_RULE,
+                args.template_pattern,
+                args.source_pattern,
+            )
+        except namingRules.RuleError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+    cache = None
+    if args.recursive and not args.no_cache:
+        cache = scanCache.shared()
+    templates = expandPaths(args.templates, args.recursive, cache, args.natural_sort)
+    sources = expandPaths(args.targets, args.recursive, cache, args.natural_sort)
+    if cache is not None:
+        cache.save()
+    basenames = renameCore.templateBasenames(templates)
+    if args.match:
+        result = tokenMatcher.matchFiles(templates, sources, len(suffixes))
+        if not result.ok():
+            summary = tokenMatcher.matchSummary(result, templates, sources)
+            print(
+                f"warning: some files couldn't be matched:\n{summary}", file=sys.stderr
+            )
+        basenames, sources = tokenMatcher.matchedLists(result, basenames, sources)
+
+    error, warning = renameCore.checkInputs(basenames, sources, suffixes)
+    if error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    if warning:
+        print(f"warning: {warning}", file=sys.stderr)
+        if not args.force and not args.dry_run:
+            print("error: use --force to rename anyway", file=sys.stderr)
+            return 2
+
+    if args.copy_to:
+        return copyTo(args, basenames, sources, suffixes, rule)
+    dests = renameCore.getDests(basenames, sources, suffixes, rule=rule)
+    report = preflightReport(sources, dests)
+    if report is None:
+        return 2
+    plan = renamePlanner.planRenames(sources, dests, report.listings)
+    if plan.conflicts:
+        for c in plan.conflicts:
+            print(f"error: {c.message}", file=sys.stderr)
+        return 2
+    if args.export_plan:
+        planFile.writePlan(args.export_plan, planFile.planOperations(plan))
+        return 0
+    if args.dry_run or args.no_journal:
+        failures = renameCore.renameFiles(
+            plan.sources, plan.dests, dryRun=args.dry_run, workers=args.jobs
+        )
+    else:
+        try:
+            failures = renameJournal.runRenames(
+                plan.sources, plan.dests, workers=args.jobs
+            )
+        except OSError as e:
+            print(f"error: couldn't write the rename journal: {e}", file=sys.stderr)
+            return 2
+    for src, dst, e in failures:
+        print(f"error: couldn't rename {src} to {dst}: {e}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def preflightReport(sources, dests, copying=False):
+    """Run preflight.checkPlan and print every problem it finds. Returns the
+    preflight.Report, or None if there were problems."""
+    report = preflight.checkPlan(sources, dests, copying)
+    for p in report.problems:
+        print(f"error: {p.message}", file=sys.stderr)
+    return None if report.problems else report
+
+
+def copyTo(args, basenames, sources, suffixes, rule=None):
+    dests = renameCore.getDests(basenames, sources, suffixes, args.copy_to, rule)
+    if preflightReport(sources, dests, copying=True) is None:
+        return 2
+    conflicts = transfer.findCopyConflicts(sources, dests)
+    if conflicts:
+        for c in conflicts:
+            print(f"error: {c.message}", file=sys.stderr)
+        return 2
+    if args.export_plan:
+        ops = planFile.planOperations(sources=sources, dests=dests)
+        planFile.writePlan(args.export_plan, ops)
+        return 0
+    if args.dry_run:
+        for src, dst in zip(sources, dests):
+            print(f"{src} got copied to {dst}")
+        return 0
+    os.makedirs(args.copy_to, exist_ok=True)
+    failures = transfer.copyFiles(sources, dests, workers=args.jobs)
+    for src, dst, e in failures:
+        print(f"error: couldn't copy {src} to {dst}: {e}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def runJournal(args):
+    """--undo and --resume"""
+    undo = args.undo is not None
+    path = args.undo if undo else args.resume
+    if not path:
+        path = renameJournal.latest() if undo else renameJournal.interrupted()
+    if path is None:
+        what = "to undo" if undo else "that was interrupted"
+        print(f"error: there's no rename {what}", file=sys.stderr)
+        return 2
+    try:
+        if args.dry_run:
+            state = renameJournal.readJournal(path)
+            if undo:
+                sources, dests = renameJournal.undoOperations(state)
+            else:
+                todo = [i for i in range(len(state)) if not state.done[i]]
+                sources = [state.sources[i] for i in todo]
+                dests = [state.dests[i] for i in todo]
+            renameCore.renameFiles(sources, dests, dryRun=True)
+            return 0
+        if undo:
+            plan, failures = renameJournal.undo(path, workers=args.jobs)
+        else:
+            state, failures = renameJournal.resume(path, workers=args.jobs)
+    except (OSError, renameJournal.JournalError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    for src, dst, e in failures:
+        print(f"error: couldn't rename {src} to {dst}: {e}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def applyPlan(args):
+    def onFailure(action, src, dst, e):
+        verb = "copy" if action == "copy" else "rename"
+        print(f"error: couldn't {verb} {src} to {dst}: {e}", file=sys.stderr)
+
+    try:
+        done, skipped, failed = planFile.applyPlan(
+            args.apply_plan,
+            chunkSize=args.chunk_size,
+            workers=args.jobs,
+            dryRun=args.dry_run,
+            onFailure=onFailure,
+        )
+    except (OSError, planFile.PlanError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    if skipped:
+        print(f"{skipped} entries were already done", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
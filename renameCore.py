@@ -0,0 +1,231 @@
+# Headless rename engine: builds the rename plan from template names, target
+# paths and suffixes, validates it, and executes it. Nothing in here imports
+# PySide6 so it can be used from the command line (see renameCli.py) as well
+# as from the GUI.
+
+import errno
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import namingRules
+import tracing
+
+NOTHING_TO_RENAME = "There is nothing to rename."
+COUNT_MISMATCH = (
+    "The number of files on the left must be the same as the number of "
+    "files on the right times the number of files to rename per template "
+    "file (specified at the top left)."
+)
+EMPTY_SUFFIX = (
+    "At least one suffix is empty. Be careful that your files don't "
+    "overwrite each other!"
+)
+BAD_SUFFIX = (
+    "Suffixes can't contain any of " + " ".join(namingRules.FORBIDDEN_CHARS) + "; "
+    "they only go in the new filename, not a folder."
+)
+DUPLICATE_SUFFIX = (
+    "At least two of the suffixes are the same. Be careful that your files "
+    "don't overwrite each other!"
+)
+
+# Renames on network filesystems mostly wait on round trips, so several can be
+# in flight at once. This caps how many.
+DEFAULT_WORKERS = 8
+# Renames in one directory that don't depend on each other are handed out to
+# the workers in pieces of this size
+CHUNK_SIZE = 256
+
+
+def templateBasenames(templatePaths):
+    """Return the filenames of templatePaths without directory or extension."""
+    return [os.path.splitext(os.path.basename(p))[0] for p in templatePaths]
+
+
+def checkInputs(basenames, sources, suffixes):
+    """Validate the inputs to getDests.
+
+    Returns a tuple (error, warning). error is a message if the inputs can't
+    be used at all, warning is a message if they can be used but probably
+    shouldn't be. Either is None if there's nothing to report.
+    """
+    if len(sources) == 0:
+        # No input
+        return NOTHING_TO_RENAME, None
+    elif len(sources) != len(basenames) * len(suffixes):
+        # Bad input
+        return COUNT_MISMATCH, None
+    elif any(c in namingRules.FORBIDDEN_CHARS for s in suffixes for c in s):
+        # A suffix could point the new name into another folder
+        return BAD_SUFFIX, None
+    elif not all(suffixes):
+        # There is at least one empty suffix
+        return None, EMPTY_SUFFIX
+    elif len(suffixes) != len(set(suffixes)):
+        # There are duplicate suffixes
+        return None, DUPLICATE_SUFFIX
+    return None, None
+
+
+def newFilename(basename, suffix, ext):
+    """New filename for a file with extension ext, given its template
+    basename and suffix."""
+    return f"{basename}{suffix}{ext}"
+
+
+def iterDests(basenames, sources, suffixes, destDir=None, rule=None):
+    """Like getDests, but takes any iterables of basenames and sources and
+    yields (source, dest) pairs one at a time instead of building a list."""
+    sources = iter(sources)
+    fileIndex = 0
+    for index, b in enumerate(basenames, 1):
+        for suf in suffixes:
+            src = next(sources)
+            fileIndex += 1
+            srcDir = destDir if destDir is not None else os.path.dirname(src)
+            stem, ext = os.path.splitext(src)
+            if rule is None:
+                name = newFilename(b, suf, ext)
+            else:
+                source = os.path.basename(stem)
+                name = rule(b, suf, ext, source, index, fileIndex)
+            yield src, os.path.join(srcDir, name)
+
+
+def getDests(basenames, sources, suffixes, destDir=None, rule=None):
+    """Pair each source with a template basename and suffix by position and
+    return the list of destination paths, one per source. The new names go
+    in destDir if it's given, otherwise next to each source. rule is an
+    optional namingRules.NamingRule to build the names with instead of
+    newFilename."""
+    with tracing.span("dests", files=len(sources)):
+        pairs = iterDests(basenames, sources, suffixes, destDir, rule)
+        return [d for s, d in pairs]
+
+
+def groupOperations(sources, dests, chunkSize=CHUNK_SIZE):
+    """Split the renames into groups of plan indices that can run at the same
+    time as each other.
+
+    Renames are grouped by the device and directory of their source. Inside
+    a group the renames stay in order, since one may free up a name another
+    one needs. If none of a directory's destinations is also one of its
+    sources, the order doesn't matter and the group is split into chunks.
+    """
+    allSources = set(sources)
+    for src, dst in zip(sources, dests):
+        if dst in allSources and os.path.dirname(dst) != os.path.dirname(src):
+            # Renames depend on each other across directories, so the whole
+            # plan has to run in order
+            return [list(range(len(sources)))]
+    byDir = {}
+    devices = {}
+    for i, src in enumerate(sources):
+        d = os.path.dirname(src)
+        if d not in devices:
+            tracing.count("stat calls")
+            try:
+                devices[d] = os.stat(d or ".").st_dev
+            except OSError:
+                devices[d] = None
+        byDir.setdefault((devices[d], d), []).append(i)
+    groups = []
+    for idxs in byDir.values():
+        if any(dests[i] in allSources for i in idxs):
+            groups.append(idxs)
+        else:
+            groups.extend(
+                idxs[j : j + chunkSize] for j in range(0, len(idxs), chunkSize)
+            )
+    return groups
+
+
+def renameFiles(
+    sources, dests, dryRun=False, workers=DEFAULT_WORKERS, progress=None, journal=None
+):
+    """Rename each source to its dest.
+
+    Independent groups of renames (see groupOperations) run on a pool of up
+    to `workers` threads. progress, if given, is called as
+    progress(done, total) from whichever thread finished a rename. journal,
+    if given, is a renameJournal.Journal that journal.done(i) is called on
+    for each rename that goes through.
+
+    Returns a list of (src, dst, exception) for every rename that failed, in
+    plan order, so one bad file doesn't stop the rest of the batch. Renames
+    that would have gone to the name of a file that failed to move are
+    skipped and returned as failures too. If dryRun is true, the moves are
+    only printed.
+    """
+    total = len(sources)
+    if dryRun:
+        for src, dst in zip(sources, dests):
+            print(f"{src} got moved to {dst}")
+        if progress is not None and total:
+            progress(total, total)
+        return []
+
+    lock = threading.Lock()
+    failures = []
+    done = 0
+
+    def runGroup(idxs):
+        nonlocal done
+        # Sources that are still where they were because their rename failed
+        # or was skipped. A later rename in the group onto one of them would
+        # overwrite it.
+        stuck = set()
+        for i in idxs:
+            if dests[i] in stuck:
+                name = os.path.basename(dests[i])
+                error = OSError(
+                    errno.ECANCELED, f"skipped because {name} couldn't be moved"
+                )
+            else:
+                if tracing.enabled:
+                    start = time.perf_counter()
+                try:
+                    os.rename(sources[i], dests[i])
+                    error = None
+                except OSError as e:
+                    error = e
+                if tracing.enabled:
+                    tracing.sample(
+                        "rename latency (ms)", (time.perf_counter() - start) * 1e3
+                    )
+            if error is not None:
+                stuck.add(sources[i])
+                with lock:
+                    failures.append((i, error))
+            elif journal is not None:
+                journal.done(i)
+            with lock:
+                done += 1
+                n = done
+            if progress is not None:
+                progress(n, total)
+
+    with tracing.span("rename", files=total):
+        groups = groupOperations(sources, dests)
+        if workers <= 1 or len(groups) <= 1:
+            for g in groups:
+                runGroup(g)
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+                # list() so exceptions from the workers aren't swallowed
+                list(pool.map(runGroup, groups))
+    tracing.count("files renamed", total - len(failures))
+    failures.sort(key=lambda f: f[0])
+    return [(sources[i], dests[i], e) for i, e in failures]
+
+
+def failureSummary(failures, total, limit=10, action="renamed"):
+    """Describe a list of failures from renameFiles in a few lines."""
+    lines = [f"{len(failures)} of {total} files couldn't be {action}:"]
+    for src, dst, e in failures[:limit]:
+        reason = e.strerror or str(e)
+        lines.append(f"{os.path.basename(src)} -> {os.path.basename(dst)}: {reason}")
+    if len(failures) > limit:
+        lines.append(f"...and {len(failures) - limit} more.")
+    return "\n".join(lines)
@@ -0,0 +1,500 @@
+# Journal of each batch of renames, so a batch that was interrupted (by a
+# crash, a power cut or the program being killed) can be finished or undone,
+# and a finished one can be undone. A journal is a JSON Lines file:
+#
+#   {"version": 1, "action": "rename", "count": 3, "undoes": null}
+#   [["/a/x.srt", "/a/A.en.srt"], ...]   the renames in plan order, a few
+#   ...                                   thousand to a line
+#   {"done": [0, 2]}                      renames that have gone through
+#   {"end": true}                         the batch ran to the end
+#   {"undone": "/.../journal.jsonl"}      the journal of the batch undoing it
+#
+# The plan is written and synced to disk before the first rename. Finished
+# renames are then recorded a group at a time with one fsync per group rather
+# than one per file, so keeping the journal barely slows the batch down. If
+# the program stops before a group is synced, the renames in it are worked
+# out from what's on disk when the journal is read again.
+#
+# Undoing a batch runs its finished renames backwards as a batch of its own,
+# with its own journal, so an interrupted undo can be resumed too.
+
+import errno
+import json
+import os
+import threading
+import time
+import renameCore
+import renamePlanner
+import scanCache
+import tracing
+
+JOURNAL_VERSION = 1
+# Finished renames are synced to the journal once this many have piled up,
+# or once this many seconds have passed since the last sync
+GROUP_SIZE = 1000
+GROUP_SECONDS = 0.5
+# Finished journals kept for undo; older ones are deleted
+KEEP_JOURNALS = 20
+# Renames written to each line of the plan
+PLAN_LINE_SIZE = 10000
+# Bytes read from the end of a journal to find out how it ended
+TAIL_BYTES = 64 * 1024
+
+
+class JournalError(ValueError):
+    pass
+
+
+def defaultDir():
+    return os.path.join(os.path.dirname(scanCache.defaultPath()), "journals")
+
+
+def _syncDir(path):
+    # Makes a new file's directory entry durable; not possible on Windows
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """An open journal that finished renames are recorded in. Use
+    createJournal to start a new one."""
+
+    def __init__(self, path):
+        """Open the journal at path to carry on recording in it."""
+        self.path = path
+        self.file = open(path, "a+b")
+        # Leave a line torn by a crash on its own so it's skipped on reading
+        if self.file.tell():
+            self.file.seek(-1, os.SEEK_END)
+            if self.file.read(1) != b"\n":
+                self.file.write(b"\n")
+        self.lock = threading.Lock()
+        self.syncLock = threading.Lock()
+        self.pending = []
+        self.lastSync = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(finished=exc[0] is None)
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+
+    def done(self, i):
+        """Record that rename i has gone through. Safe to call from several
+        threads; every GROUP_SIZE renames or GROUP_SECONDS the calling thread
+        writes them all out with one fsync."""
+        with self.lock:
+            self.pending.append(i)
+            now = time.monotonic()
+            if len(self.pending) < GROUP_SIZE and now - self.lastSync < GROUP_SECONDS:
+                return
+            group, self.pending = self.pending, []
+            self.lastSync = now
+        self._sync(group)
+
+    def _sync(self, group):
+        with self.syncLock:
+            if group:
+                self._write({"done": group})
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            tracing.count("journal syncs")
+
+    def flush(self):
+        with self.lock:
+            group, self.pending = self.pending, []
+            self.lastSync = time.monotonic()
+        self._sync(group)
+
+    def mark(self, key, value):
+        """Append a {key: value} record and sync it."""
+        with self.syncLock:
+            self._write({key: value})
+        self.flush()
+
+    def close(self, finished=True):
+        """Sync what's left, and record that the batch ran to the end if
+        finished is set."""
+        if self.file.closed:
+            return
+        self.flush()
+        if finished:
+            self.mark("end", True)
+        self.file.close()
+
+
+class Recorder:
+    """Passes done(i) from renameCore.renameFiles on to a journal, as
+    done(indices[i]) if only part of the journal's plan is being run.
+    Positions in urgent (see producedRenames) are synced straight away
+    rather than with the next group."""
+
+    def __init__(self, journal, indices=None, urgent=()):
+        self.journal = journal
+        self.indices = indices
+        self.urgent = urgent
+
+    def done(self, i):
+        if self.indices is not None:
+            i = self.indices[i]
+        self.journal.done(i)
+        if i in self.urgent:
+            self.journal.flush()
+
+
+def newPath(directory=None):
+    directory = directory or defaultDir()
+    # Sorting the names puts the journals in the order they were made
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+    name = f"{stamp}-{int(now % 1 * 1e6):06d}-{os.getpid()}.jsonl"
+    return os.path.join(directory, name)
+
+
+def createJournal(path, sources, dests, action="rename", undoes=None):
+    """Write a new journal for renaming sources to dests, synced to disk,
+    and return it open as a Journal."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    header = {
+        "version": JOURNAL_VERSION,
+        "action": action,
+        "count": len(sources),
+        "undoes": undoes,
+    }
+    with tracing.span("journal", files=len(sources)):
+        lines = [json.dumps(header)]
+        for i in range(0, len(sources), PLAN_LINE_SIZE):
+            pairs = zip(sources[i : i + PLAN_LINE_SIZE], dests[i : i + PLAN_LINE_SIZE])
+            lines.append(json.dumps(list(pairs), ensure_ascii=False))
+        with open(path, "xb") as f:
+            try:
+                f.write("\n".join(lines).encode() + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError:
+                # Don't leave half a journal to be found later
+                f.close()
+                os.remove(path)
+                raise
+        _syncDir(directory)
+    return Journal(path)
+
+
+class JournalState:
+    """Everything in a journal file, as read by readJournal."""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.action = header["action"]
+        self.undoes = header.get("undoes")
+        self.sources = []
+        self.dests = []
+        self.done = None
+        self.finished = False
+        self.undone = None
+        # Renames worked out to have gone through without being recorded
+        self.inferred = []
+
+    def __len__(self):
+        return len(self.sources)
+
+
+def _readHeader(f, path):
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("version") != JOURNAL_VERSION:
+        raise JournalError(f"{path} isn't a rename journal.")
+    return header
+
+
+def readJournal(path):
+    """Read a journal. Renames that went through but weren't recorded
+    before the program stopped are worked out from the files on disk."""
+    with open(path, "rb") as f:
+        header = _readHeader(f, path)
+        state = JournalState(path, header)
+        count = header["count"]
+        try:
+            while len(state.sources) < count:
+                pairs = json.loads(f.readline())
+                state.sources.extend(src for src, dst in pairs)
+                state.dests.extend(dst for src, dst in pairs)
+        except (ValueError, TypeError):
+            raise JournalError(f"{path} is damaged.")
+        state.done = bytearray(count)
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn by a crash while it was being written
+                continue
+            if "done" in record:
+                for i in record["done"]:
+                    state.done[i] = 1
+            elif "end" in record:
+                state.finished = True
+            elif "undone" in record:
+                state.undone = record["undone"]
+    if not state.finished:
+        state.inferred = inferDone(state.sources, state.dests, state.done)
+    return state
+
+
+def producedRenames(sources, dests):
+    """Positions of the renames whose source is made by an earlier rename,
+    like temp -> B in A -> temp, B -> A, temp -> B. A cycle like that leaves
+    the same names on disk as before it ran, so whether these went through
+    can't be told from the disk: they're recorded as soon as they go through
+    and only taken as done if they were."""
+    made = set()
+    produced = set()
+    for i, (src, dst) in enumerate(zip(sources, dests)):
+        if src in made:
+            produced.add(i)
+        made.add(dst)
+    return produced
+
+
+def inferDone(sources, dests, done):
+    """Mark the renames in done (a bytearray with one flag per rename) that
+    went through without being recorded, and return their positions.
+
+    A rename has gone through if its source is gone and its destination is
+    there, or if a later rename that needed its source out of the way has
+    gone through (a later rename can use the name of an earlier one's
+    source, e.g. A -> temp then B -> A). Going backwards through the plan
+    sees the later ones first.
+    """
+    produced = producedRenames(sources, dests)
+    inferred = []
+    freed = set()
+    for i in range(len(sources) - 1, -1, -1):
+        src, dst = sources[i], dests[i]
+        if not done[i] and i not in produced:
+            if src in freed or (not os.path.lexists(src) and os.path.lexists(dst)):
+                done[i] = 1
+                inferred.append(i)
+        if done[i]:
+            freed.add(dst)
+    return inferred
+
+
+def status(path):
+    """(header, finished, undone) for a journal, reading only its first line
+    and its end."""
+    with open(path, "rb") as f:
+        header = _readHeader(f, path)
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - TAIL_BYTES))
+        tail = f.read().splitlines()
+    finished = False
+    undone = None
+    for line in tail[1:] if len(tail) > 1 else tail:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict):
+            finished = finished or "end" in record
+            undone = record.get("undone", undone)
+    return header, finished, undone
+
+
+def journals(directory=None):
+    """Paths of the journals in directory, oldest first."""
+    directory = directory or defaultDir()
+    try:
+        names = sorted(n for n in os.listdir(directory) if n.endswith(".jsonl"))
+    except OSError:
+        return []
+    return [os.path.join(directory, n) for n in names]
+
+
+def interrupted(directory=None):
+    """The newest journal of a batch that didn't run to the end, or None."""
+    for path in reversed(journals(directory)):
+        try:
+            header, finished, undone = status(path)
+        except (OSError, JournalError):
+            continue
+        return None if finished else path
+    return None
+
+
+def latest(directory=None):
+    """The newest journal of a batch that can be undone, or None. Batches
+    that were already undone and the undo batches themselves are skipped,
+    so undoing again goes further back."""
+    for path in reversed(journals(directory)):
+        try:
+            header, finished, undone = status(path)
+        except (OSError, JournalError):
+            continue
+        if header["action"] == "rename" and undone is None:
+            return path
+    return None
+
+
+def prune(directory=None, keep=KEEP_JOURNALS):
+    """Delete the oldest finished journals, keeping the newest `keep`.
+    Journals of interrupted batches are never deleted."""
+    paths = journals(directory)
+    for path in paths[: max(0, len(paths) - keep)]:
+        try:
+            if status(path)[1]:
+                os.remove(path)
+        except (OSError, JournalError):
+            pass
+
+
+def checkOperations(sources, dests):
+    """Split renames into the ones that can run and failures for the rest,
+    in the same form as renameCore.renameFiles returns them. Renames are
+    checked in order against the files on disk as the earlier ones will
+    leave them, so none of them overwrites a file. Returns (indices,
+    failures)."""
+    created = set()
+    removed = set()
+    # One listing per directory rather than a stat per file
+    listings = {}
+
+    def exists(p):
+        if p in created:
+            return True
+        if p in removed:
+            return False
+        head, tail = os.path.split(p)
+        names = listings.get(head)
+        if names is None:
+            try:
+                with os.scandir(head or ".") as it:
+                    names = {e.name for e in it}
+            except OSError:
+                names = set()
+            listings[head] = names
+        return tail in names
+
+    ok = []
+    failures = []
+    for i, (src, dst) in enumerate(zip(sources, dests)):
+        if not exists(src):
+            code = errno.ENOENT
+        elif exists(dst):
+            code = errno.EEXIST
+        else:
+            ok.append(i)
+            removed.add(src)
+            created.discard(src)
+            created.add(dst)
+            removed.discard(dst)
+            continue
+        failures.append((src, dst, OSError(code, os.strerror(code))))
+    return ok, failures
+
+
+def _run(journal, sources, dests, workers, progress, indices=None, urgent=()):
+    recorder = Recorder(journal, indices, urgent)
+    failures = renameCore.renameFiles(
+        sources, dests, workers=workers, progress=progress, journal=recorder
+    )
+    journal.close()
+    return failures
+
+
+def runRenames(
+    sources,
+    dests,
+    path=None,
+    workers=renameCore.DEFAULT_WORKERS,
+    progress=None,
+    action="rename",
+    undoes=None,
+):
+    """Rename sources to dests like renameCore.renameFiles, keeping a
+    journal of it at path (a new file in defaultDir() if not given). undoes
+    is the journal of the batch this one undoes, if it's an undo. Returns
+    the failures from renameFiles."""
+    if path is None:
+        prune()
+        path = newPath()
+    journal = createJournal(path, sources, dests, action, undoes)
+    if undoes is not None:
+        # Marked before anything runs, so an interrupted undo is only ever
+        # resumed and never started again, which would redo swaps
+        _markUndone(undoes, path)
+    urgent = producedRenames(sources, dests)
+    return _run(journal, sources, dests, workers, progress, urgent=urgent)
+
+
+def _markUndone(path, undoPath):
+    with Journal(path) as journal:
+        journal.mark("undone", undoPath)
+
+
+def resume(path, workers=renameCore.DEFAULT_WORKERS, progress=None):
+    """Run the renames of an interrupted batch that hadn't gone through.
+    Returns (state, failures)."""
+    state = readJournal(path)
+    if state.finished:
+        return state, []
+    journal = Journal(path)
+    if state.inferred:
+        journal.mark("done", sorted(state.inferred))
+    indices = [i for i in range(len(state)) if not state.done[i]]
+    sources = [state.sources[i] for i in indices]
+    dests = [state.dests[i] for i in indices]
+    ok, failures = checkOperations(sources, dests)
+    failures += _run(
+        journal,
+        [sources[i] for i in ok],
+        [dests[i] for i in ok],
+        workers,
+        progress,
+        [indices[i] for i in ok],
+        producedRenames(state.sources, state.dests),
+    )
+    return state, failures
+
+
+def undoOperations(state):
+    """The renames that put back what a batch did, as (sources, dests)."""
+    done = [i for i in range(len(state)) if state.done[i]]
+    sources = [state.dests[i] for i in reversed(done)]
+    dests = [state.sources[i] for i in reversed(done)]
+    return sources, dests
+
+
+def undo(path, workers=renameCore.DEFAULT_WORKERS, progress=None):
+    """Undo the renames recorded in a journal, as a new journaled batch.
+    Files that were changed since are left alone and listed in the failures.
+    A batch can only be undone once. Returns (plan, failures), where plan is
+    a renamePlanner.RenamePlan of the renames that undo the batch."""
+    state = readJournal(path)
+    if state.undone is not None:
+        raise JournalError(f"{path} was already undone.")
+    sources, dests = undoOperations(state)
+    if not sources:
+        _markUndone(path, True)
+        return renamePlanner.RenamePlan([], [], []), []
+    # Files changed since the batch ran are left alone
+    ok, skipped = checkOperations(sources, dests)
+    failures = runRenames(
+        [sources[i] for i in ok],
+        [dests[i] for i in ok],
+        workers=workers,
+        progress=progress,
+        action="undo",
+        undoes=path,
+    )
+    return renamePlanner.RenamePlan(sources, dests, []), skipped + failures
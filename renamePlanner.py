@@ -0,0 +1,191 @@
+# Turns a list of (source, destination) pairs into a list of renames that can
+# be run one after another without overwriting anything. Finds destinations
+# that clash with existing files or with each other, puts renames in an order
+# where every destination is free by the time it's used (A->B runs after
+# B->C), and breaks swaps like A->B, B->A with a temporary name. Everything is
+# done with dict/set lookups and one directory listing per directory, so it
+# stays linear in the number of files.
+
+import os
+from collections import namedtuple
+import tracing
+
+# kind is one of "duplicate source", "duplicate destination" or "exists"
+Conflict = namedtuple("Conflict", ["kind", "source", "dest", "message"])
+
+
+class RenamePlan:
+    def __init__(self, sources, dests, conflicts):
+        # The renames to run, in order. These can include renames to and
+        # from temporary names, so they aren't the same as the pairs the
+        # plan was made from.
+        self.sources = sources
+        self.dests = dests
+        self.conflicts = conflicts
+
+    def __len__(self):
+        return len(self.sources)
+
+
+def listDirectories(dirs):
+    """Return {directory: set of names in it} with one listing per directory.
+    Directories that can't be read are treated as empty."""
+    listings = {}
+    tracing.count("directory listings", len(dirs))
+    for d in dirs:
+        try:
+            with os.scandir(d or ".") as it:
+                listings[d] = {e.name for e in it}
+        except OSError:
+            listings[d] = set()
+    return listings
+
+
+def findConflicts(sources, dests, listings):
+    conflicts = []
+    sourceIndex = {}
+    for i, src in enumerate(sources):
+        if src in sourceIndex:
+            conflicts.append(
+                Conflict(
+                    "duplicate source",
+                    src,
+                    dests[i],
+                    f"{src} is in the list of files to rename more than once.",
+                )
+            )
+        else:
+            sourceIndex[src] = i
+    # Files that keep their name stay where they are, so their names aren't
+    # freed up for other renames
+    moving = {src for src, dst in zip(sources, dests) if src != dst}
+    destIndex = {}
+    for i, (src, dst) in enumerate(zip(sources, dests)):
+        if src == dst:
+            continue
+        if dst in destIndex:
+            other = sources[destIndex[dst]]
+            conflicts.append(
+                Conflict(
+                    "duplicate destination",
+                    src,
+                    dst,
+                    f"{other} and {src} would both be renamed to {dst}.",
+                )
+            )
+            continue
+        destIndex[dst] = i
+        head, tail = os.path.split(dst)
+        # Existing files are only a problem if they aren't going to be
+        # renamed out of the way first
+        if tail in listings[head] and dst not in moving:
+            conflicts.append(
+                Conflict(
+                    "exists",
+                    src,
+                    dst,
+                    f"Renaming {src} would overwrite {dst}, which already exists.",
+                )
+            )
+    return conflicts
+
+
+def tempName(path, taken):
+    """A name in the same directory as path that isn't in taken."""
+    head, tail = os.path.split(path)
+    n = 0
+    while True:
+        name = f".{tail}.renametmp{n}"
+        if name not in taken:
+            taken.add(name)
+            return os.path.join(head, name)
+        n += 1
+
+
+def orderRenames(sources, dests, listings):
+    """Order the renames so that each destination is free when it's used.
+
+    Each rename i that targets another rename's source has to wait for that
+    one, so following "waits for" links gives chains, which are run from the
+    far end back, and cycles, which are broken by moving one file to a
+    temporary name first.
+    """
+    sourceIndex = {src: i for i, src in enumerate(sources)}
+    waitsFor = [sourceIndex.get(dst) for dst in dests]
+    # 0 = not placed yet, 1 = on the current path, 2 = placed
+    state = bytearray(len(sources))
+    outSources = []
+    outDests = []
+    for start in range(len(sources)):
+        if state[start]:
+            continue
+        path = []
+        i = start
+        while i is not None and state[i] == 0:
+            state[i] = 1
+            path.append(i)
+            i = waitsFor[i]
+        loops = i is not None and state[i] == 1
+        for j in path:
+            state[j] = 2
+        if loops:
+            # The path loops back on itself at i
+            m = path.index(i)
+            cycle = path[m:]
+            head = cycle[0]
+            tmp = tempName(sources[head], listings[os.path.dirname(sources[head])])
+            outSources.append(sources[head])
+            outDests.append(tmp)
+            for j in reversed(cycle[1:]):
+                outSources.append(sources[j])
+                outDests.append(dests[j])
+            outSources.append(tmp)
+            outDests.append(dests[head])
+            path = path[:m]
+        for j in reversed(path):
+            outSources.append(sources[j])
+            outDests.append(dests[j])
+    return outSources, outDests
+
+
+def planRenames(sources, dests, listings=None):
+    """Check and order the renames of sources to dests.
+
+    Returns a RenamePlan. If plan.conflicts isn't empty, running the plan
+    would lose files. Renames where the name doesn't change are left out.
+    listings can be the listings from a preflight.Report to save listing
+    the directories again; they're changed by the planning.
+    """
+    with tracing.span("plan", files=len(sources)):
+        if listings is None:
+            dirs = {os.path.dirname(p) for p in sources}
+            dirs.update(os.path.dirname(p) for p in dests)
+            listings = listDirectories(dirs)
+        conflicts = findConflicts(sources, dests, listings)
+        pairs = [(s, d) for s, d in zip(sources, dests) if s != d]
+        srcs = [s for s, d in pairs]
+        dsts = [d for s, d in pairs]
+        if conflicts:
+            return RenamePlan(srcs, dsts, conflicts)
+        # Temporary names shouldn't clash with anything that will exist later
+        for d in dests:
+            head, tail = os.path.split(d)
+            listings[head].add(tail)
+        outSources, outDests = orderRenames(srcs, dsts, listings)
+        return RenamePlan(outSources, outDests, conflicts)
+
+
+def finalPaths(plan, sources, failures):
+    """Where each of sources ended up after running plan, given the failures
+    returned by renameCore.renameFiles."""
+    failed = {(src, dst) for src, dst, e in failures}
+    # current path -> original path
+    origin = {src: src for src in sources}
+    for src, dst in zip(plan.sources, plan.dests):
+        if (src, dst) in failed:
+            continue
+        o = origin.pop(src, None)
+        if o is not None:
+            origin[dst] = o
+    where = {o: cur for cur, o in origin.items()}
+    return [where.get(src, src) for src in sources]
@@ -0,0 +1,137 @@
+# On-disk cache of directory listings for dirScanner.scanTree, so adding the
+# same big folder again doesn't mean reading every directory in it again.
+# Each directory's listing is stored along with its mtime. A directory's mtime
+# changes whenever a file is added to, removed from or renamed in it, so on a
+# rescan a directory only has to be stat'ed, and it's only listed again if
+# its mtime is different. The least recently used directories are dropped
+# once the cache holds more than a set number of names.
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_VERSION = 1
+# Total number of names kept across every cached directory
+MAX_ENTRIES = 2_000_000
+# Directories changed this recently aren't cached, since another change within
+# the same mtime tick (up to 2s on FAT) wouldn't be noticed
+RACY_SECONDS = 2
+
+
+def defaultPath():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "filename-based-rename", "scan-cache.json")
+
+
+class ScanCache:
+    def __init__(self, path=None, maxEntries=MAX_ENTRIES):
+        """path is the file the cache is kept in. Nothing is read until
+        load() is called."""
+        self.path = path or defaultPath()
+        self.maxEntries = maxEntries
+        # directory -> (mtime_ns, names), least recently used first
+        self.dirs = OrderedDict()
+        self.entries = 0
+        self.changed = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.dirs)
+
+    def load(self):
+        """Read the cache file. A missing or unreadable file gives an empty
+        cache."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            return
+        with self.lock:
+            self.dirs.clear()
+            self.entries = 0
+            for d, mtime, names in data["dirs"]:
+                self.dirs[d] = (mtime, names)
+                self.entries += len(names)
+            self.evict()
+            self.changed = False
+
+    def save(self):
+        """Write the cache file if anything changed since it was loaded."""
+        with self.lock:
+            if not self.changed:
+                return
+            data = {
+                "version": CACHE_VERSION,
+                "dirs": [[d, m, names] for d, (m, names) in self.dirs.items()],
+            }
+            self.changed = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Write to a new file and swap it in, so a crash can't leave half a
+        # cache behind
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def get(self, path, mtime):
+        """The cached listing of path, or None if there isn't one for this
+        mtime."""
+        with self.lock:
+            cached = self.dirs.get(path)
+            if cached is None or cached[0] != mtime:
+                return None
+            self.dirs.move_to_end(path)
+            return cached[1]
+
+    def put(self, path, mtime, names):
+        """Remember the listing of path, which had the given mtime in
+        nanoseconds before it was read."""
+        if time.time_ns() - mtime < RACY_SECONDS * 1_000_000_000:
+            return
+        with self.lock:
+            old = self.dirs.pop(path, None)
+            if old is not None:
+                self.entries -= len(old[1])
+            self.dirs[path] = (mtime, names)
+            self.entries += len(names)
+            self.evict()
+            self.changed = True
+
+    def evict(self):
+        while self.entries > self.maxEntries and self.dirs:
+            d, (mtime, names) = self.dirs.popitem(last=False)
+            self.entries -= len(names)
+
+    def clear(self):
+        with self.lock:
+            self.changed = bool(self.dirs)
+            self.dirs.clear()
+            self.entries = 0
+
+
+_shared = None
+_sharedLock = threading.Lock()
+
+
+def shared():
+    """The cache at the default path, loaded the first time it's asked for."""
+    global _shared
+    with _sharedLock:
+        if _shared is None:
+            _shared = ScanCache()
+            _shared.load()
+        return _shared
@@ -0,0 +1,103 @@
+import os
+import pytest
+import renameJournal
+import renamePlanner
+
+# (original names, renames asked for, what each name holds afterwards)
+BATCHES = {
+    "swap": (["a", "b"], [("a", "b"), ("b", "a")], {"a": "b", "b": "a"}),
+    "rotation and chain": (
+        ["a", "b", "c", "d"],
+        [("a", "b"), ("b", "c"), ("c", "a"), ("d", "e")],
+        {"a": "c", "b": "a", "c": "b", "e": "d"},
+    ),
+}
+
+
+@pytest.fixture(autouse=True)
+def journalDir(tmp_path, monkeypatch):
+    # Undo journals go to the default folder
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+
+def makeBatch(tmp_path, name):
+    names, pairs, after = BATCHES[name]
+    dir = tmp_path / "files"
+    dir.mkdir()
+    for n in names:
+        (dir / n).write_text(n)
+    plan = renamePlanner.planRenames(
+        [str(dir / s) for s, d in pairs], [str(dir / d) for s, d in pairs]
+    )
+    assert plan.conflicts == []
+    before = {n: n for n in names}
+    return dir, plan, before, after
+
+
+def contents(dir):
+    return {p.name: p.read_text() for p in dir.iterdir()}
+
+
+def crash(path, plan, k, recordAll):
+    """Run the first k renames of a journaled batch and stop the way a crash
+    would. Only the renames that are synced straight away are recorded,
+    unless recordAll is set."""
+    journal = renameJournal.createJournal(path, plan.sources, plan.dests)
+    urgent = renameJournal.producedRenames(plan.sources, plan.dests)
+    for i in range(k):
+        os.rename(plan.sources[i], plan.dests[i])
+        if recordAll or i in urgent:
+            journal.done(i)
+            journal.flush()
+    journal.file.close()
+
+
+def crashPoints():
+    for name, (names, pairs, after) in BATCHES.items():
+        # The planner adds a temporary rename for each cycle
+        for k in range(len(pairs) + 2):
+            for recordAll in (False, True):
+                yield name, k, recordAll
+
+
+@pytest.mark.parametrize("name, k, recordAll", list(crashPoints()))
+def test_resume_after_crash(tmp_path, name, k, recordAll):
+    dir, plan, before, after = makeBatch(tmp_path, name)
+    path = str(tmp_path / "journal.jsonl")
+    crash(path, plan, min(k, len(plan)), recordAll)
+    state, failures = renameJournal.resume(path, workers=1)
+    assert failures == []
+    assert contents(dir) == after
+    assert renameJournal.readJournal(path).done == bytearray([1]) * len(plan)
+
+
+@pytest.mark.parametrize("name, k, recordAll", list(crashPoints()))
+def test_undo_after_crash(tmp_path, name, k, recordAll):
+    dir, plan, before, after = makeBatch(tmp_path, name)
+    path = str(tmp_path / "journal.jsonl")
+    crash(path, plan, min(k, len(plan)), recordAll)
+    undoPlan, failures = renameJournal.undo(path, workers=1)
+    assert failures == []
+    assert contents(dir) == before
+
+
+def test_undo_after_resume(tmp_path):
+    dir, plan, before, after = makeBatch(tmp_path, "swap")
+    path = str(tmp_path / "journal.jsonl")
+    crash(path, plan, 1, False)
+    renameJournal.resume(path, workers=1)
+    renameJournal.undo(path, workers=1)
+    assert contents(dir) == before
+    with pytest.raises(renameJournal.JournalError):
+        renameJournal.undo(path, workers=1)
+
+
+def test_finished_cycle_is_not_run_again(tmp_path):
+    dir, plan, before, after = makeBatch(tmp_path, "swap")
+    path = str(tmp_path / "journal.jsonl")
+    crash(path, plan, len(plan), False)
+    # Every name is back on disk, so only the record of the temporary
+    # name's rename tells the cycle went through
+    assert renameJournal.readJournal(path).done == bytearray([1]) * len(plan)
+    renameJournal.resume(path, workers=1)
+    assert contents(dir) == after
@@ -0,0 +1,91 @@
+import os
+import renameCore
+import renamePlanner
+
+
+def makeFiles(dir, names):
+    """Create files in dir whose contents are their names."""
+    for name in names:
+        with open(os.path.join(dir, name), "w") as f:
+            f.write(name)
+
+
+def contents(dir):
+    result = {}
+    for name in os.listdir(dir):
+        with open(os.path.join(dir, name)) as f:
+            result[name] = f.read()
+    return result
+
+
+def plan(dir, pairs):
+    sources = [os.path.join(dir, s) for s, d in pairs]
+    dests = [os.path.join(dir, d) for s, d in pairs]
+    return renamePlanner.planRenames(sources, dests)
+
+
+def run(dir, pairs):
+    p = plan(dir, pairs)
+    assert p.conflicts == []
+    assert renameCore.renameFiles(p.sources, p.dests, workers=1) == []
+    return p
+
+
+def kinds(p):
+    return [c.kind for c in p.conflicts]
+
+
+def test_existing_file_is_a_conflict(tmp_path):
+    makeFiles(tmp_path, ["a", "b"])
+    assert kinds(plan(tmp_path, [("a", "b")])) == ["exists"]
+
+
+def test_file_keeping_its_name_is_occupied(tmp_path):
+    makeFiles(tmp_path, ["a", "b"])
+    p = plan(tmp_path, [("a", "a"), ("b", "a")])
+    assert kinds(p) == ["exists"]
+
+
+def test_duplicate_destination(tmp_path):
+    makeFiles(tmp_path, ["a", "b"])
+    assert kinds(plan(tmp_path, [("a", "c"), ("b", "c")])) == ["duplicate destination"]
+
+
+def test_duplicate_source(tmp_path):
+    makeFiles(tmp_path, ["a"])
+    assert "duplicate source" in kinds(plan(tmp_path, [("a", "b"), ("a", "c")]))
+
+
+def test_chain_runs_from_the_far_end(tmp_path):
+    makeFiles(tmp_path, ["a", "b"])
+    run(tmp_path, [("a", "b"), ("b", "c")])
+    assert contents(tmp_path) == {"b": "a", "c": "b"}
+
+
+def test_swap_uses_a_temporary_name(tmp_path):
+    makeFiles(tmp_path, ["a", "b"])
+    p = run(tmp_path, [("a", "b"), ("b", "a")])
+    assert len(p) == 3
+    assert contents(tmp_path) == {"a": "b", "b": "a"}
+
+
+def test_rotation_with_a_chain_into_it(tmp_path):
+    makeFiles(tmp_path, ["a", "b", "c", "d"])
+    run(tmp_path, [("a", "b"), ("b", "c"), ("c", "a"), ("d", "e")])
+    assert contents(tmp_path) == {"a": "c", "b": "a", "c": "b", "e": "d"}
+
+
+def test_failed_rename_skips_the_ones_that_depend_on_it(tmp_path, monkeypatch):
+    makeFiles(tmp_path, ["a", "b", "c"])
+    p = plan(tmp_path, [("a", "b"), ("b", "c"), ("c", "d")])
+    realRename = os.rename
+
+    def rename(src, dst):
+        if src.endswith("c"):
+            raise OSError(5, "Input/output error")
+        realRename(src, dst)
+
+    monkeypatch.setattr(os, "rename", rename)
+    failures = renameCore.renameFiles(p.sources, p.dests, workers=1)
+    assert len(failures) == 3
+    assert contents(tmp_path) == {"a": "a", "b": "b", "c": "c"}
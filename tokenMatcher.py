@@ -0,0 +1,140 @@
+# Pair files to be renamed with their template files by the season/episode
+# numbers in their names instead of by their position in the lists. The
+# templates go in an index keyed by those numbers, so every target is matched
+# with a dict lookup rather than by comparing it against every template.
+
+import os
+import re
+import tracing
+
+# S01E02, s1e2, S01 E02
+SEASON_EPISODE_RE = re.compile(r"s(\d{1,3})[\s._-]*e(\d{1,4})", re.IGNORECASE)
+# 1x02
+CROSS_RE = re.compile(r"(?<!\d)(\d{1,2})x(\d{2,4})(?!\d)", re.IGNORECASE)
+# Episode 2, Ep.02, E02
+EPISODE_RE = re.compile(
+    r"(?<![a-z])(?:episode|ep|e)[\s._-]*(\d{1,4})(?!\d)", re.IGNORECASE
+)
+# Any other number that isn't a resolution (1080p), codec (x264) or year
+NUMBER_RE = re.compile(r"(?<![\dxh])(\d{1,4})(?![\dpi])", re.IGNORECASE)
+
+
+def _isYear(s):
+    return len(s) == 4 and s[:2] in ("19", "20")
+
+
+def extractKey(name):
+    """Return (season, episode) from a filename, with season None if the
+    name only has an episode number. Returns None if no number is found."""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    m = SEASON_EPISODE_RE.search(stem) or CROSS_RE.search(stem)
+    if m:
+        return int(m.group(1)), int(m.group(2))
+    m = EPISODE_RE.search(stem)
+    if m:
+        return None, int(m.group(1))
+    numbers = [n for n in NUMBER_RE.findall(stem) if not _isYear(n)]
+    if numbers:
+        # Show names can have numbers in them too, the episode usually
+        # comes last
+        return None, int(numbers[-1])
+    return None
+
+
+class MatchResult:
+    def __init__(self):
+        # Template indices and, for each, the target indices matched to it in
+        # the order they were given
+        self.groups = []
+        # Targets with no number, or whose number no template has
+        self.unmatched = []
+        # (target index, [template indices]) for targets that fit more than
+        # one template
+        self.ambiguous = []
+        # (template index, [target indices]) for templates that didn't get
+        # exactly the right number of targets
+        self.incomplete = []
+
+    def ok(self):
+        return not (self.unmatched or self.ambiguous or self.incomplete)
+
+
+def buildIndex(templates):
+    """Map each key, and each episode number on its own, to the templates
+    that have it. Returns (index, noSeason), where noSeason only has the
+    templates without a season number, keyed by episode."""
+    index = {}
+    noSeason = {}
+    for i, t in enumerate(templates):
+        key = extractKey(t)
+        if key is None:
+            continue
+        index.setdefault(key, []).append(i)
+        if key[0] is not None:
+            # So targets without a season can still find this template
+            index.setdefault((None, key[1]), []).append(i)
+        else:
+            noSeason.setdefault(key[1], []).append(i)
+    return index, noSeason
+
+
+def matchFiles(templates, targets, perTemplate):
+    """Match targets to templates by their numbers. Each template should end
+    up with perTemplate targets. Returns a MatchResult."""
+    with tracing.span("match", templates=len(templates), targets=len(targets)):
+        return _matchFiles(templates, targets, perTemplate)
+
+
+def _matchFiles(templates, targets, perTemplate):
+    index, noSeason = buildIndex(templates)
+    result = MatchResult()
+    matched = {}
+    for j, t in enumerate(targets):
+        key = extractKey(t)
+        candidates = index.get(key, []) if key is not None else []
+        if not candidates and key is not None and key[0] is not None:
+            # The templates might not have season numbers, but a template
+            # from another season isn't a match
+            candidates = noSeason.get(key[1], [])
+        if len(candidates) == 1:
+            matched.setdefault(candidates[0], []).append(j)
+        elif candidates:
+            result.ambiguous.append((j, candidates))
+        else:
+            result.unmatched.append(j)
+    for i in range(len(templates)):
+        group = matched.get(i, [])
+        if len(group) == perTemplate:
+            result.groups.append((i, group))
+        else:
+            result.incomplete.append((i, group))
+    return result
+
+
+def matchedLists(result, basenames, sources):
+    """Reorder basenames and sources so that renameCore.getDests pairs them
+    the way result says. Templates that weren't fully matched are dropped."""
+    newBasenames = []
+    newSources = []
+    for i, group in result.groups:
+        newBasenames.append(basenames[i])
+        newSources.extend(sources[j] for j in group)
+    return newBasenames, newSources
+
+
+def matchSummary(result, templates, targets, limit=10):
+    """Describe what couldn't be matched in a few lines."""
+    lines = []
+    name = os.path.basename
+    problems = (
+        [f"No template for {name(targets[j])}" for j in result.unmatched]
+        + [
+            f"{name(targets[j])} fits {len(c)} templates, e.g. {name(templates[c[0]])}"
+            for j, c in result.ambiguous
+        ]
+        + [f"{name(templates[i])} matched {len(g)} files" for i, g in result.incomplete]
+    )
+    lines.extend(problems[:limit])
+    if len(problems) > limit:
+        lines.append(f"...and {len(problems) - limit} more.")
+    return "\n".join(lines)
@@ -0,0 +1,144 @@
+# Opt-in timing of each stage of a rename. Set the RENAME_TRACE environment
+# variable to a file path (or pass --trace to renameCli.py) and the spans,
+# counters and latency samples recorded below are written there as Chrome
+# trace-event JSON when the program exits. Load the file in chrome://tracing
+# or https://ui.perfetto.dev to see where the time went.
+#
+# When tracing is off, span() hands back a shared do-nothing context manager
+# and the other functions return straight away, so leaving the calls in the
+# code costs next to nothing.
+
+# https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+ENV_VAR = "RENAME_TRACE"
+PERCENTILES = (50, 90, 99)
+
+enabled = False
+_path = None
+_lock = threading.Lock()
+_events = []
+_counters = {}
+_samples = {}
+_start = time.perf_counter()
+_noSpan = contextlib.nullcontext()
+
+
+def enable(path):
+    """Start recording, and write the trace to path when the program exits."""
+    global enabled, _path
+    if not enabled:
+        atexit.register(lambda: export(_path))
+    enabled = True
+    _path = path
+
+
+def _now():
+    # Microseconds, which is what the trace format uses
+    return (time.perf_counter() - _start) * 1e6
+
+
+class _Span:
+    __slots__ = ("name", "args", "begin")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.begin = _now()
+        return self
+
+    def __exit__(self, *exc):
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": self.begin,
+            "dur": _now() - self.begin,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if self.args:
+            event["args"] = self.args
+        _events.append(event)
+        return False
+
+
+def span(name, **args):
+    """Context manager timing the code inside it as one stage."""
+    if not enabled:
+        return _noSpan
+    return _Span(name, args)
+
+
+def count(name, n=1):
+    """Add n to a counter, e.g. the number of files scanned."""
+    if not enabled:
+        return
+    with _lock:
+        total = _counters[name] = _counters.get(name, 0) + n
+        _events.append(
+            {
+                "name": name,
+                "ph": "C",
+                "ts": _now(),
+                "pid": os.getpid(),
+                "args": {name: total},
+            }
+        )
+
+
+def sample(name, value):
+    """Record one measurement, e.g. how long a rename took, for percentiles."""
+    if not enabled:
+        return
+    with _lock:
+        _samples.setdefault(name, []).append(value)
+
+
+def percentiles(values):
+    values = sorted(values)
+    result = {}
+    for p in PERCENTILES:
+        i = min(len(values) - 1, int(len(values) * p / 100))
+        result[f"p{p}"] = values[i]
+    result["max"] = values[-1]
+    result["count"] = len(values)
+    return result
+
+
+def summary():
+    """Counter totals and sample percentiles recorded so far."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "percentiles": {k: percentiles(v) for k, v in _samples.items() if v},
+        }
+
+
+def export(path):
+    """Write everything recorded so far to path as Chrome trace-event JSON."""
+    if not path:
+        return
+    info = summary()
+    events = list(_events)
+    for name, stats in info["percentiles"].items():
+        # Show up as a counter track at the end of the trace as well
+        args = {k: v for k, v in stats.items() if k != "count"}
+        events.append(
+            {"name": name, "ph": "C", "ts": _now(), "pid": os.getpid(), "args": args}
+        )
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"traceEvents": events, "displayTimeUnit": "ms", "otherData": info}, f
+        )
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
@@ -0,0 +1,338 @@
+# Copies files to new names instead of renaming them, so the originals stay
+# where they are. Each copy uses the fastest way the filesystems allow: a
+# reflink (the copy shares blocks with the original until either changes),
+# then copy_file_range or sendfile (the kernel copies the data without it
+# going through Python), then plain reads and writes with a large buffer.
+#
+# Copies run in parallel, but the buffers for plain copies come from a fixed
+# pool, so memory use stays within a budget however many files there are.
+# Data goes to <dest>.part first and is only moved to <dest> once it's
+# complete. Running the same batch again skips finished copies and carries
+# on from the end of any .part file, so an interrupted batch can be resumed.
+#
+# Finished copies are recorded in a CopyRecord, one JSON Lines file per
+# destination folder kept with the program's other state, so only files this
+# program copied count as finished: an unrelated file that happens to have
+# the same size and time is reported instead of skipped. A batch's entries
+# are dropped again once all of it has gone through.
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from renamePlanner import Conflict
+import scanCache
+import tracing
+
+if sys.platform == "linux":
+    import fcntl
+
+# Number of files copied at once
+DEFAULT_WORKERS = 4
+# Buffer size for plain copies, and how much to copy per kernel call
+BUFFER_SIZE = 8 * 1024 * 1024
+# Most memory to use for buffers across all workers
+MEMORY_BUDGET = 64 * 1024 * 1024
+PART_SUFFIX = ".part"
+# ioctl that makes dst share src's data, on Btrfs, XFS and others
+FICLONE = 0x40049409
+
+# Ways of copying that turned out not to work between two devices, as
+# (method, source device, destination device)
+_unsupported = set()
+_unsupportedLock = threading.Lock()
+
+
+def partPath(dest):
+    return dest + PART_SUFFIX
+
+
+def recordDir():
+    return os.path.join(os.path.dirname(scanCache.defaultPath()), "copies")
+
+
+class CopyRecord:
+    """The finished copies into the folders of some destination paths."""
+
+    def __init__(self, dests, directory=None):
+        self.directory = directory or recordDir()
+        self.lock = threading.Lock()
+        # {dest: (source, size, mtime)} with absolute paths
+        self.entries = {}
+        self.folders = {os.path.dirname(os.path.abspath(d)) for d in dests}
+        for folder in self.folders:
+            try:
+                with open(self.path(folder), "rb") as f:
+                    for line in f:
+                        try:
+                            src, dst, size, mtime = json.loads(line)
+                        except ValueError:
+                            # Torn by a crash while it was being written
+                            continue
+                        self.entries[dst] = (src, size, mtime)
+            except OSError:
+                pass
+
+    def path(self, folder):
+        name = hashlib.sha1(os.fsencode(folder)).hexdigest()
+        return os.path.join(self.directory, name + ".jsonl")
+
+    def isComplete(self, src, dest, srcStat=None):
+        """Whether dest is a finished copy of src made by copyFiles."""
+        entry = self.entries.get(os.path.abspath(dest))
+        if entry is None or entry[0] != os.path.abspath(src):
+            return False
+        try:
+            st = os.stat(dest)
+            srcStat = srcStat or os.stat(src)
+        except OSError:
+            return False
+        # copyFile gives the copy the same modification time as the original
+        return (
+            (st.st_size, st.st_mtime_ns) == entry[1:]
+            and srcStat.st_size == st.st_size
+            and int(srcStat.st_mtime) == int(st.st_mtime)
+        )
+
+    def add(self, src, dest):
+        """Record that dest was just copied from src."""
+        st = os.stat(dest)
+        src, dest = os.path.abspath(src), os.path.abspath(dest)
+        line = json.dumps([src, dest, st.st_size, st.st_mtime_ns], ensure_ascii=False)
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(os.path.dirname(dest)), "ab") as f:
+                f.write(line.encode() + b"\n")
+            self.entries[dest] = (src, st.st_size, st.st_mtime_ns)
+
+    def forget(self, dests):
+        """Drop the entries for dests, once they don't need resuming."""
+        with self.lock:
+            for d in dests:
+                self.entries.pop(os.path.abspath(d), None)
+            for folder in self.folders:
+                kept = [
+                    json.dumps([src, dst, size, mtime], ensure_ascii=False)
+                    for dst, (src, size, mtime) in self.entries.items()
+                    if os.path.dirname(dst) == folder
+                ]
+                path = self.path(folder)
+                try:
+                    if kept:
+                        with open(path, "w", encoding="utf-8") as f:
+                            f.write("\n".join(kept) + "\n")
+                    else:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def findCopyConflicts(sources, dests, record=None):
+    """Destinations that are used twice, or that already exist and aren't a
+    finished copy of their source in record (a CopyRecord, read for dests
+    if not given). Returns a list of Conflicts."""
+    if record is None:
+        record = CopyRecord(dests)
+    conflicts = []
+    seen = {}
+    for src, dst in zip(sources, dests):
+        if dst in seen:
+            conflicts.append(
+                Conflict(
+                    "duplicate destination",
+                    src,
+                    dst,
+                    f"{seen[dst]} and {src} would both be copied to {dst}.",
+                )
+            )
+            continue
+        seen[dst] = src
+        if os.path.lexists(dst) and not record.isComplete(src, dst):
+            conflicts.append(
+                Conflict(
+                    "exists",
+                    src,
+                    dst,
+                    f"Copying {src} would overwrite {dst}, which already exists.",
+                )
+            )
+    return conflicts
+
+
+def _supported(method, devices):
+    return (method, *devices) not in _unsupported
+
+
+def _markUnsupported(method, devices):
+    with _unsupportedLock:
+        _unsupported.add((method, *devices))
+
+
+class _Copier:
+    """State shared by the workers of one copyFiles call."""
+
+    def __init__(self, total, progress, memoryBudget, bufferSize, record):
+        self.record = record
+        self.total = total
+        self.done = 0
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.bufferSize = bufferSize
+        # Buffers are only made when a plain copy needs one, and there are
+        # never more than the budget allows
+        self.bufferSlots = threading.Semaphore(max(1, memoryBudget // bufferSize))
+        self.buffers = []
+
+    def advance(self, n):
+        with self.lock:
+            self.done += n
+            done = self.done
+        if self.progress is not None:
+            self.progress(done, self.total)
+
+    def copy(self, src, dst):
+        srcStat = os.stat(src)
+        if self.record.isComplete(src, dst, srcStat):
+            self.advance(srcStat.st_size)
+            return
+        part = partPath(dst)
+        try:
+            offset = os.path.getsize(part)
+        except OSError:
+            offset = 0
+        if offset > srcStat.st_size:
+            offset = 0
+        self.advance(offset)
+        # Not opened for appending, since copy_file_range refuses those
+        with open(src, "rb") as fsrc, open(part, "r+b" if offset else "wb") as fdst:
+            devices = (srcStat.st_dev, os.fstat(fdst.fileno()).st_dev)
+            self.copyData(fsrc, fdst, offset, srcStat.st_size, devices)
+        shutil.copystat(src, part)
+        os.replace(part, dst)
+        self.record.add(src, dst)
+
+    def copyData(self, fsrc, fdst, offset, size, devices):
+        src, dst = fsrc.fileno(), fdst.fileno()
+        if offset == 0 and sys.platform == "linux" and _supported("reflink", devices):
+            try:
+                fcntl.ioctl(dst, FICLONE, src)
+                tracing.count("reflinked files")
+                self.advance(size)
+                return
+            except OSError:
+                _markUnsupported("reflink", devices)
+        # Each fallback carries on from wherever the one before got to, so
+        # no bytes are counted twice
+        if hasattr(os, "copy_file_range") and _supported("copy_file_range", devices):
+            offset, ok = self.kernelCopy(
+                lambda n, pos: os.copy_file_range(src, dst, n, pos, pos),
+                offset,
+                size,
+            )
+            if not ok:
+                _markUnsupported("copy_file_range", devices)
+            elif offset >= size:
+                return
+        if hasattr(os, "sendfile") and _supported("sendfile", devices):
+            offset, ok = self.kernelCopy(
+                lambda n, pos: os.sendfile(dst, src, pos, n), offset, size, dst
+            )
+            if not ok:
+                _markUnsupported("sendfile", devices)
+            elif offset >= size:
+                return
+        self.bufferedCopy(fsrc, fdst, offset)
+
+    def kernelCopy(self, call, offset, size, seekFd=None):
+        """Copy with call(count, offset) until size bytes are done or the
+        call stops making progress. seekFd is a file descriptor to move to
+        offset first, for calls that write at its position. Returns the
+        offset reached and whether the call worked, as (offset, ok)."""
+        try:
+            if seekFd is not None:
+                os.lseek(seekFd, offset, os.SEEK_SET)
+            while offset < size:
+                n = call(min(self.bufferSize, size - offset), offset)
+                if n <= 0:
+                    break
+                offset += n
+                self.advance(n)
+        except OSError:
+            return offset, False
+        return offset, True
+
+    def bufferedCopy(self, fsrc, fdst, offset):
+        self.bufferSlots.acquire()
+        with self.lock:
+            buf = self.buffers.pop() if self.buffers else bytearray(self.bufferSize)
+        try:
+            view = memoryview(buf)
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            fdst.truncate()
+            while True:
+                n = fsrc.readinto(buf)
+                if not n:
+                    break
+                fdst.write(view[:n])
+                self.advance(n)
+        finally:
+            with self.lock:
+                self.buffers.append(buf)
+            self.bufferSlots.release()
+
+
+def copyFiles(
+    sources,
+    dests,
+    workers=DEFAULT_WORKERS,
+    progress=None,
+    memoryBudget=MEMORY_BUDGET,
+    bufferSize=BUFFER_SIZE,
+    record=None,
+):
+    """Copy each source to its dest.
+
+    progress, if given, is called as progress(bytesDone, bytesTotal) from
+    whichever thread copied the data. Copies that are already finished are
+    skipped and partial ones are carried on, so a batch that was interrupted
+    can be run again to finish it. record is the CopyRecord the finished
+    copies are looked up in and added to; it's read for dests if not given.
+
+    Returns a list of (src, dst, exception) for every copy that failed, in
+    order, like renameCore.renameFiles.
+    """
+    total = 0
+    for src in sources:
+        try:
+            total += os.path.getsize(src)
+        except OSError:
+            pass
+    if record is None:
+        record = CopyRecord(dests)
+    copier = _Copier(total, progress, memoryBudget, bufferSize, record)
+    failures = []
+    lock = threading.Lock()
+
+    def copyOne(i):
+        try:
+            copier.copy(sources[i], dests[i])
+        except OSError as e:
+            with lock:
+                failures.append((i, e))
+
+    with tracing.span("copy", files=len(sources), bytes=total):
+        if workers <= 1 or len(sources) <= 1:
+            for i in range(len(sources)):
+                copyOne(i)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # list() so exceptions from the workers aren't swallowed
+                list(pool.map(copyOne, range(len(sources))))
+    failures.sort(key=lambda f: f[0])
+    if not failures:
+        record.forget(dests)
+    return [(sources[i], dests[i], e) for i, e in failures]